@@ -1,14 +1,37 @@
-from biorpy import betteR
-r = betteR.BetteR()
+import importlib
 
-from biorpy import pandas_additions
+# Names exported by the package and the modules they come from. These are only imported
+# when first used, and R itself isn't started until the first actual call into R, so
+# that ``import biorpy`` stays cheap for scripts that only need part of the package.
+# (Importing the package doesn't import pandas either; DataFrame.sw() is added once 
+# biorpy.conversion is loaded.)
+LAZY_ATTRIBUTES = {"asstr": "biorpy.conversion",
+                   "asfloat": "biorpy.conversion",
+                   "asint": "biorpy.conversion",
+                   "Model": "biorpy.formula",
+                   "GAM": "biorpy.formula",
+                   "iimage": "biorpy.interactive",
+                   "png": "biorpy.interactive"}
 
+def _makeR():
+    from biorpy import betteR
+    return betteR.BetteR()
 
-try:
-    from biorpy.interactive import iimage, png
-except ImportError:
-    pass
+def __getattr__(name):
+    if name == "r":
+        value = _makeR()
+    elif name in LAZY_ATTRIBUTES:
+        try:
+            module = importlib.import_module(LAZY_ATTRIBUTES[name])
+        except ImportError:
+            # eg biorpy.interactive without IPython
+            raise AttributeError("module 'biorpy' has no attribute '{}'".format(name))
+        value = getattr(module, name)
+    else:
+        raise AttributeError("module 'biorpy' has no attribute '{}'".format(name))
 
-from biorpy.conversion import asstr, asfloat, asint
+    globals()[name] = value
+    return value
 
-from biorpy.formula import Model, GAM
+def __dir__():
+    return sorted(set(globals()) | set(LAZY_ATTRIBUTES) | set(["r"]))
@@ -0,0 +1,183 @@
+import threading
+
+from biorpy.lazymodule import LazyModule
+robjects = LazyModule("rpy2.robjects")
+rinterface = LazyModule("rpy2.rinterface")
+
+from biorpy import conversion, executor, helpers
+
+# Runs a list of list(function, args) pairs in a single call from python. Arguments of class
+# biorpyBatchRef refer to the result of an earlier call in the same batch. Errors are
+# returned as condition objects rather than stopping the rest of the batch.
+RUNNER_SOURCE = """
+function(calls) {
+    results <- vector("list", length(calls))
+    for (i in seq_along(calls)) {
+        args <- lapply(calls[[i]][[2]], function(a) {
+            if (inherits(a, "biorpyBatchRef")) results[[unclass(a)]] else a
+        })
+        results[i] <- list(tryCatch(do.call(calls[[i]][[1]], args), error=function(e) e))
+    }
+    results
+}
+"""
+
+helpers.register("batching.run", RUNNER_SOURCE)
+helpers.register("batching.eval", "function(code) eval(parse(text=code), envir=globalenv())")
+
+# per thread, so that a batch only collects the calls made by the thread that opened it
+_local = threading.local()
+
+def _batches():
+    if not hasattr(_local, "batches"):
+        _local.batches = []
+    return _local.batches
+
+def _toSexp(value):
+    """ Converts python scalars etc with rpy2's own conversion, as a direct call would """
+    if isinstance(value, rinterface.Sexp):
+        return value
+    if hasattr(robjects.conversion, "get_conversion"):
+        converter = robjects.conversion.get_conversion()
+    else:
+        converter = robjects.conversion
+    py2rpy = getattr(converter, "py2rpy", None) or getattr(converter, "py2ri")
+    return py2rpy(value)
+
+def pushBatch(batch):
+    """ Makes batch (unless None) the current batch of this thread, without running it at the end """
+    if batch is not None:
+        _batches().append(batch)
+
+def popBatch(batch):
+    if batch is not None:
+        _batches().remove(batch)
+
+def currentBatch():
+    """ The innermost active :class:`Batch`, or None if calls should run immediately """
+    batches = _batches()
+    if batches:
+        return batches[-1]
+    return None
+
+
+class BatchResult(object):
+    """ A placeholder for the result of a call made inside a batch. It can be passed as an
+    argument to later calls in the same batch; its value is available once the batch has run. """
+
+    def __init__(self, batch, position, rname, wrapResults=True):
+        self.batch = batch
+        self.position = position
+        self.rname = rname
+        self.wrapResults = wrapResults
+        self.done = False
+        self._value = None
+        self._error = None
+
+    def _set(self, value, error=None):
+        self._value = value
+        self._error = error
+        self.done = True
+
+    @property
+    def value(self):
+        if not self.done:
+            raise Exception("The batch containing this call to {} hasn't been run yet".format(self.rname))
+        if self._error is not None:
+            raise Exception("Error in batched call to {}: {}".format(self.rname, self._error))
+        return self._value
+
+    def __repr__(self):
+        state = "done" if self.done else "pending"
+        return "<BatchResult {} ({})>".format(self.rname, state)
+
+
+class Batch(object):
+    """ Collects :class:`biorpy.betteR.Handler` calls and executes them all in a single
+    round-trip to R when the ``with`` block ends (or when :meth:`run` is called).
+
+    Inside the batch, handler calls return :class:`BatchResult` objects instead of R values::
+
+        with r.batch():
+            for x, y in points:
+                r.points(x, y)
+            coords = r.barplot(heights)
+            r.text(coords, heights, labels)   # refers to the barplot() result
+        print(coords.value)
+    """
+
+    def __init__(self):
+        self._calls = []
+        self._results = []
+
+    def __enter__(self):
+        pushBatch(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        popBatch(self)
+        if exc_type is None:
+            self.run()
+
+    def __len__(self):
+        return len(self._calls)
+
+    def _reference(self, arg):
+        if isinstance(arg, BatchResult) and arg.batch is self and not arg.done:
+            ref = rinterface.IntSexpVector([arg.position + 1])
+            ref.do_slot_assign("class", rinterface.StrSexpVector(["biorpyBatchRef"]))
+            return ref
+        if isinstance(arg, BatchResult):
+            return _toSexp(arg.value)
+        return _toSexp(arg)
+
+    def add(self, handler, args, kwdargs):
+        """ Queues a call with already-converted arguments, returning its :class:`BatchResult` """
+        return self._queue(handler._robject, handler.rname, args, kwdargs, handler.wrapResults)
+
+    def addEval(self, code, wrapResults=True):
+        """ Queues the evaluation of a string of R code (as for ``r("...")``) """
+        return self._queue(helpers.get("batching.eval"), "r()", [rinterface.StrSexpVector([code])], {}, wrapResults)
+
+    def _queue(self, rfunction, rname, args, kwdargs, wrapResults):
+        values = [self._reference(arg) for arg in args]
+        names = [""] * len(args)
+        for name, arg in kwdargs.items():
+            values.append(self._reference(arg))
+            names.append(name)
+
+        rargs = rinterface.ListSexpVector(values)
+        rargs.do_slot_assign("names", rinterface.StrSexpVector(names))
+        self._calls.append(rinterface.ListSexpVector([rfunction, rargs]))
+
+        result = BatchResult(self, len(self._results), rname, wrapResults)
+        self._results.append(result)
+        return result
+
+    def run(self):
+        """ Executes all queued calls in R, filling in their results """
+        executor.runOnRThread(self._run)
+
+    def _run(self):
+        if not self._calls:
+            return
+
+        calls, results = self._calls, self._results
+        self._calls, self._results = [], []
+
+        rvals = helpers.get("batching.run")(rinterface.ListSexpVector(calls))
+        errors = []
+        for result, rval in zip(results, rvals):
+            rclass = conversion._rclass(rval)
+            if "error" in rclass and "condition" in rclass:
+                message = rval.rx2("message")[0]
+                result._set(None, message)
+                errors.append((result.rname, message))
+            else:
+                if result.wrapResults and conversion.WRAP_RESULTS:
+                    conversion.addResultWrapper(rval)
+                result._set(rval)
+
+        if errors:
+            raise Exception("{} of {} batched R calls failed; first error in {}: {}".format(
+                len(errors), len(results), errors[0][0], errors[0][1]))
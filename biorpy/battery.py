@@ -0,0 +1,171 @@
+##
+## running one statistical test over many features in a single call into R
+##
+import numpy
+import pandas
+from biorpy.lazymodule import LazyModule
+robjects = LazyModule("rpy2.robjects")
+rinterface = LazyModule("rpy2.rinterface")
+
+from biorpy import conversion, executor, helpers
+
+SUPPORTED_TESTS = ["wilcox.test", "t.test", "cor.test", "fisher.test", "ks.test"]
+
+# Loops over the per-feature inputs inside R, collecting the statistic, p-value and
+# (first) estimate of each test; features where the test fails get NAs.
+RUNNER_SOURCE = """
+function(test, xs, ys, args) {
+    f <- match.fun(test)
+    n <- length(xs)
+    out <- matrix(NA_real_, n, 3)
+    for (i in seq_len(n)) {
+        a <- if (is.null(ys)) list(xs[[i]]) else list(xs[[i]], ys[[i]])
+        res <- tryCatch(suppressWarnings(do.call(f, c(a, args))), error=function(e) NULL)
+        if (!is.null(res)) {
+            if (!is.null(res$statistic)) out[i, 1] <- res$statistic[[1]]
+            out[i, 2] <- res$p.value
+            if (!is.null(res$estimate)) out[i, 3] <- res$estimate[[1]]
+        }
+    }
+    out
+}
+"""
+
+# Turns matrices (or long-format columns) into the per-feature lists used above
+ROWS_SOURCE = """
+function(m) lapply(seq_len(nrow(m)), function(i) m[i, ])
+"""
+TABLES_SOURCE = """
+function(m) lapply(seq_len(nrow(m)), function(i) matrix(m[i, ], 2, 2))
+"""
+SPLIT_SOURCE = """
+function(values, features) {
+    if (!is.factor(features)) features <- factor(features, levels=unique(features))
+    unname(split(values, features))
+}
+"""
+
+helpers.register("battery.run", RUNNER_SOURCE)
+helpers.register("battery.rows", ROWS_SOURCE)
+helpers.register("battery.tables", TABLES_SOURCE)
+helpers.register("battery.split", SPLIT_SOURCE)
+
+def _checkTest(test):
+    if test not in SUPPORTED_TESTS:
+        raise Exception("Unsupported test '{}'; should be one of {}".format(test, ", ".join(SUPPORTED_TESTS)))
+
+def _asMatrix(x):
+    if isinstance(x, pandas.DataFrame):
+        return conversion.dataFrameToRMatrix(x)
+    return conversion.arrayToRMatrix(numpy.asarray(x, dtype=numpy.float64))
+
+def _features(column, index=None):
+    """ The features of a long-format column (in order of first appearance, without NaN) and the
+    column as a Categorical with those as categories, to be split in the same order in R """
+    if index is None:
+        index = pandas.unique(column.dropna())
+    return index, pandas.Categorical(numpy.asarray(column), categories=numpy.asarray(index))
+
+def _run(test, xs, ys, index, padjust, testArgs):
+    args = rinterface.ListSexpVector([conversion.convertToR(value) for value in testArgs.values()])
+    args.do_slot_assign("names", rinterface.StrSexpVector(list(testArgs.keys())))
+    out = helpers.get("battery.run")(test, xs, ys if ys is not None else rinterface.NULL, args)
+
+    # copied, since the view doesn't keep the R matrix alive
+    out = conversion._bufferView(out, numpy.float64).reshape((-1, 3), order="F").copy()
+    results = pandas.DataFrame(out, index=index, columns=["statistic", "pvalue", "estimate"])
+    if padjust:
+        pvalues = robjects.r("stats::p.adjust")(robjects.FloatVector(results["pvalue"].values), method=padjust)
+        results["padj"] = numpy.asarray(pvalues)
+    return results
+
+def rowTests(test, x, y=None, groups=None, padjust=None, **testArgs):
+    """
+    Runs an R test on each row of a matrix, looping inside R rather than in python.
+
+    Args:
+        test: one of "wilcox.test", "t.test", "cor.test", "fisher.test" or "ks.test"
+        x: a 2-d array or DataFrame, one row per feature (for fisher.test, each row holds the
+            4 counts of a 2x2 table, in column-major order)
+        y: an optional second matrix with the same number of rows; row i of x is tested
+            against row i of y (eg for cor.test, or two-sample tests)
+        groups: alternatively, a vector with one label per column of x, with exactly two distinct
+            values; for each row, the columns of the first group are tested against the second
+        padjust: an optional p.adjust() method (eg "BH") used to add a "padj" column
+        testArgs: additional arguments passed to each test, eg ``paired=True``
+
+    Returns:
+        A DataFrame with one row per feature, and the statistic, pvalue and estimate of each test
+        (NaN where the test failed, or doesn't report a value)
+    """
+    rexecutor = executor.activeExecutor()
+    if rexecutor is not None and not rexecutor.onThread():
+        return rexecutor.submit(rowTests, test, x, y, groups, padjust, **testArgs).result()
+
+    _checkTest(test)
+    index = x.index if isinstance(x, pandas.DataFrame) else None
+
+    if test == "fisher.test":
+        xs = helpers.get("battery.tables")(_asMatrix(x))
+        return _run(test, xs, None, index, padjust, testArgs)
+
+    if groups is not None:
+        groups = numpy.asarray(groups)
+        labels = pandas.unique(groups)
+        if len(labels) != 2:
+            raise Exception("groups should have exactly two distinct values, not {}".format(len(labels)))
+        values = numpy.asarray(x, dtype=numpy.float64)
+        x, y = values[:, groups == labels[0]], values[:, groups == labels[1]]
+
+    rows = helpers.get("battery.rows")
+    xs = rows(_asMatrix(x))
+    ys = rows(_asMatrix(y)) if y is not None else None
+
+    return _run(test, xs, ys, index, padjust, testArgs)
+
+def longTests(test, df, feature, value, group=None, value2=None, padjust=None, **testArgs):
+    """
+    Runs an R test for each feature of a long-format DataFrame, looping inside R.
+
+    Args:
+        test: one of "wilcox.test", "t.test", "cor.test", "fisher.test" or "ks.test"
+        df: the DataFrame
+        feature: the column identifying the feature (eg gene) each row belongs to
+        value: the column with the values to test
+        group: an optional column with two distinct values; for each feature, the values of the
+            first group are tested against those of the second
+        value2: alternatively, a second value column to test against value (eg for cor.test)
+        padjust: an optional p.adjust() method (eg "BH") used to add a "padj" column
+        testArgs: additional arguments passed to each test
+
+    Returns:
+        A DataFrame indexed by feature (in order of first appearance), as for :func:`rowTests`
+    """
+    rexecutor = executor.activeExecutor()
+    if rexecutor is not None and not rexecutor.onThread():
+        return rexecutor.submit(longTests, test, df, feature, value, group, value2, padjust, **testArgs).result()
+
+    _checkTest(test)
+    split = helpers.get("battery.split")
+
+    if group is not None:
+        labels = pandas.unique(df[group])
+        if len(labels) != 2:
+            raise Exception("{} should have exactly two distinct values, not {}".format(group, len(labels)))
+        first = df[df[group] == labels[0]]
+        second = df[df[group] == labels[1]]
+
+        index, _ = _features(df[feature])
+        # make sure every feature appears in both groups, in the same order
+        xs = split(conversion.convertToR(first[value]),
+                   conversion.categoricalToRFactor(_features(first[feature], index)[1]))
+        ys = split(conversion.convertToR(second[value]),
+                   conversion.categoricalToRFactor(_features(second[feature], index)[1]))
+        return _run(test, xs, ys, index, padjust, testArgs)
+
+    index, features = _features(df[feature])
+    features = conversion.categoricalToRFactor(features)
+    xs = split(conversion.convertToR(df[value]), features)
+    ys = split(conversion.convertToR(df[value2]), features) if value2 is not None else None
+
+    return _run(test, xs, ys, index, padjust, testArgs)
@@ -1,7 +1,12 @@
 import pydoc
-from rpy2 import robjects
 import operator
 
+import pandas
+
+from biorpy.lazymodule import LazyModule
+robjects = LazyModule("rpy2.robjects")
+
+from biorpy import batching, conversion, executor, helpers, memory, profiling, refs
 from biorpy.conversion import convertToR, addResultWrapper
 
 def isIPy():
@@ -30,21 +35,21 @@ def item(i):
 
 
 
-def getDefaultHandlers(converter):
+def getDefaultHandlers(converter, wrapResults=True):
     handlers = []
     handlers.append(Handler("wilcox.test", 
         # outputs={"p.value":[rx("p.value"), item(0), item(0)]},
-        converter=converter)
+        converter=converter, wrapResults=wrapResults)
     )
 
     handlers.append(Handler("plot", 
         defaults={"xlab":"", "ylab":"", "main":""},
-        converter=converter)
+        converter=converter, wrapResults=wrapResults)
     )
 
     handlers.append(Handler("hist", 
         defaults={"xlab":"", "main":""},
-        converter=converter)
+        converter=converter, wrapResults=wrapResults)
     )
 
     return handlers
@@ -53,6 +58,22 @@ def getDefaultAliases():
     return {"devoff":"dev.off"}
 
 
+# functions to call once R is first used (R itself is only started at that point)
+_startHooks = [helpers.loadPreloads]
+
+def _runStartHooks():
+    while _startHooks:
+        _startHooks.pop(0)()
+
+def resolve(rname):
+    """ Looks up an R object by name; namespace-qualified names (eg "stats::wilcox.test") 
+    are evaluated so that they come from the given package """
+    _runStartHooks()
+    if "::" in rname:
+        return robjects.r(rname)
+    return robjects.r[rname]
+
+
 class Handler(object):
     """ Wrapper for R objects to implement:
     
@@ -62,7 +83,8 @@ class Handler(object):
 
     """
 
-    def __init__(self, rname, pyname=None, defaults=None, converter=convertToR, beforeFn=None, afterFn=None):
+    def __init__(self, rname, pyname=None, defaults=None, converter=convertToR, beforeFn=None, afterFn=None,
+                 wrapResults=True, cache=None):
         """
         Args
             name: name of the R function
@@ -70,6 +92,9 @@ class Handler(object):
             outputs: a dictionary whose values are lists of functions used to extract values from 
                 the return R value. For example: {"p.value":[rx("p.value"), item(0), item(0)]}
             converter: a conversion function used to convert python objects into R objects
+            wrapResults: whether to add the (lazily converted) ``.py`` attribute to results
+            cache: an optional :class:`biorpy.caching.ResultCache` used to memoize results; only
+                for functions without side effects
         """
         self.rname = rname
         if pyname is None:
@@ -81,33 +106,98 @@ class Handler(object):
         # self.outputs = outputs if outputs else {}
         self.converter = converter
 
-        # may want some extra error checking here
-        self._robject = robjects.r[self.rname]
+        # the R object is looked up on first use, so that creating handlers doesn't start R
+        self._rfunction = None
 
         self.beforeFn = beforeFn
         self.afterFn = afterFn
+        self.wrapResults = wrapResults
+        self.cache = cache
+
+    @property
+    def _robject(self):
+        if self._rfunction is None:
+            self._rfunction = resolve(self.rname)
+        return self._rfunction
+
+    def _convert(self, arg):
+        if isinstance(arg, refs.RRef):
+            # already in R
+            return arg.robject
+        return self.converter(arg)
+
+    def _callInBatch(self, batch, args, kwdargs):
+        batching.pushBatch(batch)
+        try:
+            return self(*args, **kwdargs)
+        finally:
+            batching.popBatch(batch)
 
     def __call__(self, *args, **kwdargs):
+        rexecutor = executor.activeExecutor()
+        if rexecutor is not None and not rexecutor.onThread():
+            # R may only be used from the executor's thread; batches are per thread, so the
+            # caller's batch (if any) goes along with the call
+            return rexecutor.submit(self._callInBatch, batching.currentBatch(), args, kwdargs).result()
+
+        timer = None
+        if profiling.activeProfilers():
+            timer = profiling.CallTimer(profiling.activeProfilers(), self.rname)
+        memoryStates = None
+        if memory.activeMonitors():
+            memoryStates = [(monitor, monitor.callStarted(self.rname)) for monitor in list(memory.activeMonitors())]
+
         if self.beforeFn is not None:
             retval = self.beforeFn(*args, **kwdargs)
             if retval is not None:
                 args, kwdargs = retval
 
         # python -> R conversion
-        args = [self.converter(arg) for arg in args]
+        args = [self._convert(arg) for arg in args]
         for kwd in kwdargs:
-            kwdargs[kwd] = self.converter(kwdargs[kwd])
+            kwdargs[kwd] = self._convert(kwdargs[kwd])
 
         # default arguments
         defaults = self.defaults.copy()
         defaults.update(kwdargs)
 
-        # call R
-        rval = robjects.r[self.rname](*args, **defaults)
-        #rval = super(Handler, self).__call__(*args, **defaults)
+        if timer is not None:
+            timer.lap("convert")
+            timer.countArguments(args, defaults)
 
-        # output conversion
-        addResultWrapper(rval)
+        batch = batching.currentBatch()
+        if batch is not None:
+            # queued to run along with the rest of the batch; returns a BatchResult
+            rval = batch.add(self, args, defaults)
+        else:
+            key = None
+            rval = None
+            if self.cache is not None:
+                key = self.cache.key(self, args, defaults)
+                rval = self.cache.get(key)
+
+            if rval is None:
+                # call R
+                rval = self._robject(*args, **defaults)
+                #rval = super(Handler, self).__call__(*args, **defaults)
+                if key is not None:
+                    self.cache.put(key, rval)
+
+            if timer is not None:
+                timer.lap("call")
+
+            # output conversion
+            if self.wrapResults and conversion.WRAP_RESULTS:
+                addResultWrapper(rval)
+                if timer is not None:
+                    conversion.setProfileName(rval, self.rname)
+
+        if timer is not None:
+            timer.lap("wrap")
+            timer.done()
+        if memoryStates is not None:
+            for monitor, state in memoryStates:
+                monitor.callFinished(self.rname, state, rval)
 
         # if self.outputs:
         #     result = {}
@@ -135,17 +225,30 @@ class Handler(object):
 class BetteR(object):
     """ Wrapper for rpy2.robjects.R """
 
-    def __init__(self, converter=convertToR):
-        """ Initialize the RPy2 wrapper instance """
+    def __init__(self, converter=convertToR, wrapResults=True):
+        """ Initialize the RPy2 wrapper instance 
+
+        Args
+            converter: the conversion function used for python -> R conversion of arguments
+            wrapResults: whether results get a ``.py`` attribute; set to False to skip 
+                this on hot paths
+        """
         self.aliases = getDefaultAliases()
+        self.converter = converter
+        self.wrapResults = wrapResults
 
         self._handlers = {}
+        self._pools = {}
+        self._executor = None
+        self.resultCache = None
+        self.profiler = None
 
-        for handler in getDefaultHandlers(converter):
+        for handler in getDefaultHandlers(converter, wrapResults):
             self.addHandler_(handler)
 
         if isInteractive():
-            self.initInteractive()
+            # deferred until R is actually used
+            _startHooks.append(self.initInteractive)
 
     def initInteractive(self):
         """ Checks to see if we're running interactively (eg ipython), and if so, 
@@ -165,35 +268,187 @@ class BetteR(object):
     def addHandler_(self, handler):
         """ Add a :class:`biorpy.betteR.Handler`."""
         self._handlers[handler.pyname] = handler
+        # drop any handler previously cached under this name (or an alias) by __getattr__
+        for name in [handler.pyname] + [alias for alias, rname in self.aliases.items() if rname == handler.pyname]:
+            self.__dict__.pop(name, None)
 
 
-    def __getattribute__(self, attr):
-        try:
-            return super(BetteR, self).__getattribute__(attr)
-        except AttributeError as ae:
-            orig_ae = ae
+    def __getattr__(self, attr):
+        """ Only called when normal attribute lookup fails, ie the first time r.<name> is used;
+        the handler is then stored as an instance attribute so that later lookups don't
+        get here at all """
+        if attr.startswith("__") or "_handlers" not in self.__dict__:
+            raise AttributeError(attr)
 
         try:
-            return self.__getitem__(attr)
+            handler = self.__getitem__(attr)
         except LookupError:
-            raise orig_ae
+            raise AttributeError("'BetteR' object has no attribute '{}'".format(attr))
+
+        self.__dict__[attr] = handler
+        return handler
 
 
     def __getitem__(self, attr):
-        if attr in self.aliases:
-            attr = self.aliases[attr]
+        attr = self.aliases.get(attr, attr)
+
+        try:
+            return self._handlers[attr]
+        except KeyError:
+            pass
 
         if attr.startswith("gg"):
             print("do something for ggplot...")
 
-        if not attr in self._handlers:
-            self._handlers[attr] = Handler(attr)
-        return self._handlers[attr]
+        handler = Handler(attr, converter=self.converter, wrapResults=self.wrapResults)
+        # fails (with a LookupError) if there's no such R object
+        handler._robject
+        self._handlers[attr] = handler
+        return handler
+
+
+    def pool(self, processes=None):
+        """ Returns a :class:`biorpy.pool.RPool` of R worker processes, for running many 
+        independent R calls in parallel (eg ``r.pool(8).map("wilcox.test", vectors)``). 
+        Pools are reused for the same number of processes. """
+        if processes not in self._pools:
+            from biorpy.pool import RPool
+            self._pools[processes] = RPool(processes, wrapResults=self.wrapResults)
+        return self._pools[processes]
+
+    def memoize(self, *rnames, **kwdargs):
+        """ Turns on result memoization for the given R functions, eg
+        ``r.memoize("wilcox.test", "p.adjust")``. Pass ``cache=`` to use a particular
+        :class:`biorpy.caching.ResultCache` (eg one with an on-disk directory); otherwise
+        they share ``r.resultCache``. Functions in ``cache.exclude`` (plotting, random numbers, 
+        ...) can't be memoized. """
+        from biorpy import caching
+
+        cache = kwdargs.pop("cache", None)
+        if cache is None:
+            if self.resultCache is None:
+                self.resultCache = caching.ResultCache()
+            cache = self.resultCache
+
+        for rname in rnames:
+            rname = self.aliases.get(rname, rname)
+            if rname in cache.exclude:
+                raise Exception("{} has side effects or isn't deterministic, and can't be memoized".format(rname))
+            self[rname].cache = cache
+        return cache
+
+    def unmemoize(self, *rnames):
+        for rname in rnames:
+            self[rname].cache = None
+
+    def executor(self):
+        """ Starts (if needed) and returns the :class:`biorpy.executor.RExecutor`; from then on, 
+        all calls into R through this module are run on a single dedicated thread, so ``r``
+        can be used from several threads """
+        if self._executor is None:
+            self._executor = executor.RExecutor().start()
+        return self._executor
+
+    @property
+    def aio(self):
+        """ asyncio interface: ``result = await r.aio.lm(...)`` (starts the executor) """
+        return executor.AsyncR(self, self.executor())
+
+    def put(self, obj, name=None):
+        """ Converts obj to R once, returning a :class:`biorpy.refs.RRef` handle that can be 
+        passed to any number of handler calls without being converted again. (R results, 
+        eg a fitted model, can be wrapped the same way.) """
+        rexecutor = executor.activeExecutor()
+        if rexecutor is not None and not rexecutor.onThread():
+            return rexecutor.submit(self.put, obj, name).result()
+
+        if isinstance(obj, batching.BatchResult):
+            # its value only exists once the batch has run
+            obj = obj.value
+
+        if isinstance(obj, pandas.DataFrame) and self.converter is convertToR:
+            # bypasses the conversion cache, which would otherwise keep the R data.frame alive
+            # after the handle is released
+            return refs.RRef(conversion.conversionCache.converter(obj), name)
+        return refs.RRef(self.converter(obj), name)
+
+    def get(self, ref):
+        """ Converts the R object behind a :class:`biorpy.refs.RRef` back to python (eg a 
+        data.frame to a pandas DataFrame) """
+        rexecutor = executor.activeExecutor()
+        if rexecutor is not None and not rexecutor.onThread():
+            return rexecutor.submit(self.get, ref).result()
+
+        return conversion.convertFromR(ref.robject)
+
+    def profile(self, exporter=None):
+        """ Returns a :class:`biorpy.profiling.Profiler` to use as a context manager; handler
+        calls within the ``with`` block are timed, stage by stage. exporter is an optional
+        function called with the details of each call. """
+        return profiling.Profiler(exporter)
+
+    def startProfiling(self, exporter=None):
+        """ Starts collecting the statistics returned by :meth:`stats` for all handler calls """
+        if self.profiler is None:
+            self.profiler = profiling.Profiler()
+        if exporter is not None:
+            self.profiler.exporters.append(exporter)
+        self.profiler.start()
+
+    def stopProfiling(self):
+        if self.profiler is not None:
+            self.profiler.stop()
+
+    def stats(self, reset=False):
+        """ A DataFrame of per-function call counts, argument sizes and times for each stage
+        (conversion, R execution, result wrapping and ``.py`` conversion) since 
+        :meth:`startProfiling` was called
 
+        Args
+            reset: clear the statistics after returning them
+        """
+        if self.profiler is None:
+            raise Exception("Profiling hasn't been started; call r.startProfiling() first")
+        stats = self.profiler.stats()
+        if reset:
+            self.profiler.reset()
+        return stats
+
+    def monitorMemory(self, exporter=None):
+        """ Returns a :class:`biorpy.memory.MemoryMonitor`; within a ``with`` block, the R heap
+        size is recorded before and after each handler call """
+        return memory.MemoryMonitor(exporter)
+
+    def memoryPolicy(self, maxBytes=None, everyCalls=None):
+        """ Starts (and returns) a :class:`biorpy.memory.MemoryPolicy`, which runs python and
+        R garbage collection once the process uses more than maxBytes, or every everyCalls
+        handler calls; call its stop() method to turn it off """
+        return memory.MemoryPolicy(maxBytes, everyCalls).start()
+
+    def memoryScope(self, keep=()):
+        """ Returns a :class:`biorpy.memory.MemoryScope`, which frees the R objects created
+        within a ``with`` block (except those still referenced, and the RRefs in keep) """
+        return memory.MemoryScope(keep)
+
+    def batch(self):
+        """ Returns a :class:`biorpy.batching.Batch`; within a ``with r.batch():`` block, 
+        handler calls are queued and then run together in a single call into R """
+        return batching.Batch()
 
     def __call__(self, string):
+        batch = batching.currentBatch()
+        if batch is not None:
+            # runs in order with the handler calls queued in the batch
+            return executor.runOnRThread(batch.addEval, string, self.wrapResults)
+
+        rexecutor = executor.activeExecutor()
+        if rexecutor is not None and not rexecutor.onThread():
+            return rexecutor.submit(self, string).result()
+
+        _runStartHooks()
         rval = robjects.r(string)
-        addResultWrapper(rval)
+        if self.wrapResults and conversion.WRAP_RESULTS:
+            addResultWrapper(rval)
 
         return rval
 
@@ -0,0 +1,227 @@
+import collections
+import glob
+import hashlib
+import os
+import weakref
+
+import numpy
+import pandas
+from biorpy.lazymodule import LazyModule
+robjects = LazyModule("rpy2.robjects")
+rinterface = LazyModule("rpy2.rinterface")
+
+
+def fingerprint(obj):
+    """ A cheap content fingerprint for a pandas or numpy object, computed with vectorized
+    hashing (much faster than converting the data). Returns None if the object can't be hashed. """
+    try:
+        if isinstance(obj, (pandas.DataFrame, pandas.Series)):
+            hashes = pandas.util.hash_pandas_object(obj, index=True).values
+            if isinstance(obj, pandas.DataFrame):
+                meta = (obj.shape, tuple(str(dtype) for dtype in obj.dtypes), tuple(obj.columns))
+            else:
+                meta = (obj.shape, str(obj.dtype), obj.name)
+        elif isinstance(obj, numpy.ndarray):
+            if obj.dtype.hasobject:
+                return None
+            hashes = numpy.ascontiguousarray(obj)
+            meta = (obj.shape, str(obj.dtype))
+        else:
+            return None
+    except TypeError:
+        return None
+
+    digest = hashlib.md5(memoryview(hashes).cast("B")).hexdigest()
+    return (meta, digest)
+
+def rObjectSize(robj):
+    """ The memory used by an R object, in bytes, as reported by R's object.size() """
+    # object.size is in utils, which baseenv lookups don't search
+    return int(robjects.r("utils::object.size")(robj)[0])
+
+
+class ConversionCache(object):
+    """ Caches the R versions of python objects, so that passing the same (unchanged)
+    DataFrame to several R calls only converts it once.
+
+    Entries are looked up by object identity, and reused only if a content fingerprint
+    still matches, so in-place modifications are picked up. The least recently used
+    entries are dropped once the R objects held take up more than maxBytes. """
+
+    def __init__(self, converter, maxBytes=2**30):
+        """
+        Args
+            converter: the function used to convert objects missing from the cache
+            maxBytes: the maximum total R memory (as measured by object.size()) to keep cached
+        """
+        self.converter = converter
+        self.maxBytes = maxBytes
+        self.enabled = True
+
+        self._entries = collections.OrderedDict()
+        self.totalBytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, obj):
+        if not self.enabled:
+            return self.converter(obj)
+
+        key = id(obj)
+        entry = self._entries.get(key)
+        if entry is not None:
+            ref, fp, robj, size = entry
+            if ref() is obj and fp == fingerprint(obj):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return robj
+            self._remove(key)
+
+        self.misses += 1
+        robj = self.converter(obj)
+
+        fp = fingerprint(obj)
+        if fp is not None:
+            try:
+                ref = weakref.ref(obj, lambda ref, key=key: self._remove(key, ref))
+            except TypeError:
+                return robj
+            size = rObjectSize(robj)
+            self._entries[key] = (ref, fp, robj, size)
+            self.totalBytes += size
+            self._evict()
+
+        return robj
+
+    def _remove(self, key, ref=None):
+        entry = self._entries.get(key)
+        if entry is None or (ref is not None and entry[0] is not ref):
+            return
+        del self._entries[key]
+        self.totalBytes -= entry[3]
+
+    def _evict(self):
+        while self.totalBytes > self.maxBytes and self._entries:
+            key = next(iter(self._entries))
+            self._remove(key)
+
+    def invalidate(self, obj=None):
+        """ Drops the cached conversion of obj, or of everything if obj is None """
+        if obj is None:
+            self._entries.clear()
+            self.totalBytes = 0
+        else:
+            self._remove(id(obj))
+
+    def __len__(self):
+        return len(self._entries)
+
+
+## RESULT MEMOIZATION
+
+# functions whose results shouldn't be memoized: they draw, depend on random numbers
+# or otherwise have side effects
+UNCACHEABLE = set(["plot", "lines", "points", "abline", "text", "mtext", "legend", "segments", 
+                   "arrows", "rect", "polygon", "axis", "title", "barplot", "boxplot", "hist", 
+                   "image", "pairs", "par", "layout", "rasterImage", "pdf", "png", "svg", "dev.off", 
+                   "set.seed", "sample", "runif", "rnorm", "rbinom", "rpois", "jitter", "library",
+                   "require", "source", "Sys.time", "assign", "rm", "print", "cat"])
+
+_packageVersionFn = {}
+
+def _packageVersion(rfunction):
+    """ Version of the package (namespace) that an R function comes from, plus R's version """
+    if not _packageVersionFn:
+        _packageVersionFn["fn"] = robjects.r("""function(f) {
+            e <- environment(f)
+            n <- if (is.null(e)) "" else environmentName(e)
+            v <- if (n %in% loadedNamespaces()) as.character(packageVersion(n)) else ""
+            paste(R.version.string, n, v)
+        }""")
+    try:
+        return str(_packageVersionFn["fn"](rfunction)[0])
+    except Exception:
+        return ""
+
+def _hashArgument(digest, arg):
+    if isinstance(arg, rinterface.Sexp):
+        digest.update(bytes(robjects.baseenv["serialize"](arg, rinterface.NULL)))
+    else:
+        digest.update(repr(arg).encode())
+
+
+class ResultCache(object):
+    """ Memoizes the results of pure R functions called through a 
+    :class:`biorpy.betteR.Handler`, keyed by the function name, the version of its package and 
+    a hash of the (converted) arguments.
+
+    Recent results are kept in memory (up to maxEntries); if a directory is given, results
+    are also saved there as .rds files so they persist across sessions. """
+
+    def __init__(self, maxEntries=128, directory=None):
+        self.maxEntries = maxEntries
+        self.directory = directory
+        self.exclude = set(UNCACHEABLE)
+
+        self._entries = collections.OrderedDict()
+        self._versions = {}
+        self.hits = 0
+        self.diskHits = 0
+        self.misses = 0
+
+    def key(self, handler, args, kwdargs):
+        """ The cache key for a call of handler with converted arguments """
+        if handler.rname not in self._versions:
+            self._versions[handler.rname] = _packageVersion(handler._robject)
+
+        digest = hashlib.sha1()
+        digest.update(handler.rname.encode())
+        digest.update(self._versions[handler.rname].encode())
+        for arg in args:
+            _hashArgument(digest, arg)
+        for name in sorted(kwdargs):
+            digest.update(name.encode())
+            _hashArgument(digest, kwdargs[name])
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".rds")
+
+    def get(self, key):
+        """ Returns the cached R result, or None """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+        if self.directory is not None and os.path.exists(self._path(key)):
+            rval = robjects.baseenv["readRDS"](self._path(key))
+            self._store(key, rval)
+            self.diskHits += 1
+            return rval
+
+        self.misses += 1
+        return None
+
+    def _store(self, key, rval):
+        self._entries[key] = rval
+        while len(self._entries) > self.maxEntries:
+            self._entries.popitem(last=False)
+
+    def put(self, key, rval):
+        self._store(key, rval)
+        if self.directory is not None:
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+            robjects.baseenv["saveRDS"](rval, self._path(key))
+
+    def clear(self, disk=False):
+        """ Empties the in-memory cache, and the on-disk store too if disk is True """
+        self._entries.clear()
+        if disk and self.directory is not None:
+            for filename in glob.glob(os.path.join(self.directory, "*.rds")):
+                os.remove(filename)
+
+    def stats(self):
+        return {"hits": self.hits, "diskHits": self.diskHits, "misses": self.misses,
+                "entries": len(self._entries)}
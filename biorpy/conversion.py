@@ -1,8 +1,17 @@
 from collections import OrderedDict
+import importlib
+import sys
 import pandas
 import numpy
-from rpy2.robjects import numpy2ri
-from rpy2 import robjects, rinterface
+
+from biorpy import caching, executor, profiling
+# imported for its side effect of adding DataFrame.sw()
+importlib.import_module("biorpy.pandas_additions")
+from biorpy.lazymodule import LazyModule
+# importing rpy2.robjects starts R, so that is put off until something is converted
+robjects = LazyModule("rpy2.robjects")
+rinterface = LazyModule("rpy2.rinterface")
+numpy2ri = LazyModule("rpy2.robjects.numpy2ri")
 
 ## CONVERSION
 
@@ -24,27 +33,33 @@ def convertToR(obj):
     an R DataFrame.  If it's a Series, treat it like a vector/numpy
     array. 
     """
+    rexecutor = executor.activeExecutor()
+    if rexecutor is not None and not rexecutor.onThread():
+        return rexecutor.submit(convertToR, obj).result()
+
     if isinstance(obj, range):
         obj = list(obj)
         
     if isinstance(obj, pandas.core.frame.DataFrame):
-        return pandasDataFrameToRPy2DataFrame(obj)
-    elif isinstance(obj, pandas.Series) or isinstance(obj, pandas.core.index.NumericIndex):
-        return convertToR(list(obj))
+        return conversionCache(obj)
+    elif isinstance(obj, pandas.Series) or isinstance(obj, pandas.Index):
+        return seriesToRVector(obj)
+    elif _isSparse(obj):
+        return sparseToRMatrix(obj)
     elif isinstance(obj, numpy.ndarray):
+        if obj.ndim == 1:
+            # NaNs in a plain float array stay NaN, as they did with numpy2ri
+            mask = pandas.isnull(obj) if obj.dtype.kind == "O" else None
+            converted = arrayToRVector(obj, mask)
+        elif obj.ndim > 1:
+            converted = arrayToRMatrix(obj)
+        else:
+            converted = None
+        if converted is not None:
+            return converted
         return numpy2ri.numpy2ri(obj)
     elif isinstance(obj, list) or isinstance(obj, tuple):
-        if len(obj) == 0:
-            return robjects.FloatVector([])
-        else:
-            try:
-                return robjects.FloatVector(obj)
-            except ValueError:
-                pass
-            try:
-                return robjects.StrVector(obj)
-            except ValueError:
-                pass
+        return sequenceToR(obj)
     elif isinstance(obj, dict):
         lengths = set()
         asrpy2 = OrderedDict()
@@ -63,137 +78,929 @@ def convertToR(obj):
 
     return obj
 
+NESTED_TYPES = (list, tuple, dict, numpy.ndarray, pandas.Series, pandas.DataFrame)
+
+def _sequenceKind(types):
+    """ Picks the R vector type for a list, given the set of python types of its elements
+    (ignoring None). Returns one of "logical", "integer", "double", "character" or "list" """
+    if not types:
+        return "logical"
+    if any(issubclass(t, NESTED_TYPES) for t in types):
+        return "list"
+    # (there can't be any R objects unless rpy2 has been loaded)
+    if "rpy2.robjects" in sys.modules and any(issubclass(t, robjects.RObjectMixin) for t in types):
+        return "list"
+    if all(issubclass(t, (bool, numpy.bool_)) for t in types):
+        return "logical"
+    if all(issubclass(t, (bool, numpy.bool_, int, numpy.integer)) for t in types):
+        return "integer"
+    if all(issubclass(t, (bool, numpy.bool_, int, float, numpy.number)) for t in types):
+        return "double"
+    return "character"
+
+def _listItemToR(item):
+    """ Converts an element of an R list; None becomes NULL and scalars length-1 vectors """
+    if item is None:
+        return rinterface.NULL
+    converted = convertToR(item)
+    if not isinstance(converted, rinterface.Sexp):
+        converted = sequenceToR([converted])
+    return converted
+
+def sequenceToR(obj):
+    """
+    Convert a list or tuple to an R vector, inferring the type from a single scan of the 
+    element types (logical, integer, double or character, like R's c()). None becomes NA.
+    Lists containing other containers become R lists, with each element converted separately.
+    """
+    if len(obj) == 0:
+        return robjects.FloatVector([])
+
+    types = set(map(type, obj))
+    hasNone = type(None) in types
+    types.discard(type(None))
+
+    kind = _sequenceKind(types)
+    if kind == "list":
+        return robjects.ListVector(rinterface.ListSexpVector([_listItemToR(item) for item in obj]))
+
+    mask = None
+    if hasNone:
+        mask = numpy.fromiter((item is None for item in obj), dtype=bool, count=len(obj))
+        fill = "" if kind == "character" else 0
+        obj = [fill if item is None else item for item in obj]
+
+    if kind == "logical":
+        values = numpy.array(obj, dtype=bool)
+    elif kind == "integer":
+        try:
+            values = numpy.array(obj, dtype=numpy.int64)
+        except OverflowError:
+            # python ints beyond int64 can still be (approximately) stored as doubles
+            values = numpy.array(obj, dtype=numpy.float64)
+    elif kind == "double":
+        values = numpy.array(obj, dtype=numpy.float64)
+    else:
+        values = numpy.array(obj, dtype=object)
+
+    return arrayToRVector(values, mask)
+
 class ResultWrapper(object):
     """ Represents output from R as a dictionary-like object, with conversion of each value
     to a pandas DataFrame or a numpy.array if possible 
 
     Attributes that contain a period in R can usually be accessed directly from python by omitting the period 
-    (eg, 'p.value' can be accessed from 'pvalue') """
-    def __init__(self, result):
+    (eg, 'p.value' can be accessed from 'pvalue') 
+
+    Each value is converted the first time it is accessed and then cached; pass cache=False
+    (or set ``conversion.CACHE_RESULTS = False`` for ``.py``) for results that may be 
+    modified in R after being wrapped. """
+    def __init__(self, result, cache=True):
         self._result = result
+        self._cache = {} if cache else None
+        self._names = None
+        self._undotted = None
 
     def __repr__(self):
         return str(dict(iter(self.items())))
     def __str__(self):
-        return str(self._result)
+        return executor.runOnRThread(str, self._result)
+
+    def _index(self):
+        """ Builds the name -> position lookup tables (only once, unless caching is off, 
+        since the names may change in R) """
+        if self._names is None or self._cache is None:
+            executor.runOnRThread(self._buildIndex)
+        return self._names
+
+    def _buildIndex(self):
+        try:
+            names = list(self._result.names)
+        except TypeError:
+            names = []
+        self._names = {}
+        for i, name in enumerate(names):
+            self._names.setdefault(name, i)
+        self._undotted = dict((name.replace(".", ""), name) for name in reversed(names))
 
     def keys(self):
-        return list(self._result.names)
+        return list(self._index())
         
     def iteritems(self):
-        for key in self._result.names:
+        for key in self.keys():
             yield (key, self[key])
+    items = iteritems
+
+    def _lookup(self, attr):
+        if self._cache is not None and attr in self._cache:
+            return self._cache[attr]
+
+        names = self._index()
+        if attr in names:
+            name = attr
+        else:
+            # see if we can find the attribute if we remove periods
+            name = self._undotted[attr]
+
+        value = executor.runOnRThread(self._fetch, names[name])
+        if self._cache is not None:
+            self._cache[attr] = value
+        return value
+
+    def _fetch(self, i):
+        if isinstance(self._result, robjects.vectors.ListVector):
+            # the element itself, without R having to look up the name again
+            return convertFromR(self._result[i])
+        # elements of atomic vectors (eg from quantile or coef) come back as length-1 arrays
+        return convertFromR(self._result.rx2(i + 1))
 
     def __getitem__(self, attr):
-        return self.__getattribute__(attr)
+        return self._lookup(attr)
 
-    def __getattribute__(self, attr):
+    def __getattr__(self, attr):
+        if attr.startswith("_"):
+            raise AttributeError(attr)
         try:
-            return super(ResultWrapper, self).__getattribute__(attr)
-        except AttributeError as ae:
-            orig_ae = ae
+            return self._lookup(attr)
+        except KeyError:
+            raise AttributeError(attr)
+
+# set to False to stop attaching .py to R results everywhere (see also the 
+# wrapResults option of Handler and BetteR)
+WRAP_RESULTS = True
+
+# set to False to convert .py afresh on every access, for R results that may be modified 
+# in place after being returned
+CACHE_RESULTS = True
+
+class LazyResult(object):
+    """ Descriptor providing the ``.py`` attribute of R results. The conversion to python 
+    (a pandas DataFrame for data.frames, a scipy.sparse matrix for sparse Matrix objects,
+    otherwise a :class:`ResultWrapper`) only happens the first time ``.py`` is accessed,
+    and is then cached on the object. """
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        if not obj.__dict__.get("_wrapResult", False):
+            raise AttributeError("py")
+
+        timer = None
+        if profiling.activeProfilers() and "_profileName" in obj.__dict__:
+            timer = profiling.CallTimer(profiling.activeProfilers(), obj.__dict__["_profileName"])
 
-        if attr in self._result.names:
-            toconvert = self._result.rx2(attr)
-            return convertFromR(toconvert)
-        else:
-            try:
-                # see if we can find the attribute if we remove periods
-                undotted_names = dict((name.replace(".", ""), name) for name in self._result.names)
-                undotted_name = undotted_names[attr]
-                return convertFromR(self._result.rx2(undotted_name))
-            except AttributeError:
-                pass
-        raise orig_ae
+        try:
+            # the conversion calls into R, so it has to happen on the R thread
+            converted = executor.runOnRThread(self._convert, obj)
+        except:
+            converted = None
+
+        if timer is not None:
+            timer.lap("py")
+            timer.done(calls=0)
+
+        if CACHE_RESULTS:
+            # instance attributes take precedence over this (non-data) descriptor from now on
+            obj.__dict__["py"] = converted
+        return converted
+
+    def _convert(self, obj):
+        if isinstance(obj, robjects.vectors.DataFrame):
+            return rpy2DataFrameToPandasDataFrame(obj)
+        if isSparseRMatrix(obj):
+            return rSparseToScipy(obj)
+        return ResultWrapper(obj, cache=CACHE_RESULTS)
+
+def isNULL(obj):
+    """ True if obj is R's NULL (rinterface.NULLType in rpy2 3, RNULLType before that) """
+    nulltype = getattr(rinterface, "NULLType", None) or getattr(rinterface, "RNULLType")
+    return isinstance(obj, nulltype)
 
 def addResultWrapper(result):
-    if isinstance(result, rinterface.RNULLType):
+    """ Marks an R result so that it gets a ``.py`` attribute, converted on first access """
+    if not isinstance(getattr(robjects.RObjectMixin, "py", None), LazyResult):
+        robjects.RObjectMixin.py = LazyResult()
+
+    if isNULL(result):
         # could convert this to numpy.nan
         return
     if isinstance(result, numpy.ndarray):
         return
 
     try:
-        if isinstance(result, robjects.vectors.DataFrame):
-            result.py = rpy2DataFrameToPandasDataFrame(result)
-        else:
-            result.py = ResultWrapper(result)
-    except:
-        result.py = None
+        result._wrapResult = True
+    except AttributeError:
+        pass
         
+def setProfileName(result, rname):
+    """ Records which R function a result came from, so that the time taken by its ``.py``
+    conversion can be attributed to it while profiling """
+    try:
+        result._profileName = rname
+    except AttributeError:
+        pass
+
 def convertFromR(obj):
+    rexecutor = executor.activeExecutor()
+    if rexecutor is not None and not rexecutor.onThread():
+        return rexecutor.submit(convertFromR, obj).result()
+
     if isinstance(obj, robjects.vectors.DataFrame):
         return rpy2DataFrameToPandasDataFrame(obj)
+    elif isinstance(obj, robjects.vectors.FactorVector):
+        return rVectorToArray(obj)
+    elif isSparseRMatrix(obj):
+        return rSparseToScipy(obj)
     elif isinstance(obj, robjects.vectors.Vector):
+        times = rTimesToArray(obj)
+        if times is not None:
+            return times
         return numpy.array(obj)
     else:
         return obj
 
 
-VECTOR_TYPES = {numpy.float64: robjects.FloatVector,
-                numpy.float32: robjects.FloatVector,
-                numpy.float: robjects.FloatVector,
-                numpy.int: robjects.IntVector,
-                numpy.int32: robjects.IntVector,
-                numpy.int64: robjects.IntVector,
-                numpy.object_: robjects.StrVector,
-                numpy.str: robjects.StrVector,
-                numpy.bool: robjects.BoolVector}
-
-NA_TYPES = {numpy.float64: robjects.NA_Real,
-            numpy.float32: robjects.NA_Real,
-            numpy.float: robjects.NA_Real,
-            numpy.int: robjects.NA_Integer,
-            numpy.int32: robjects.NA_Integer,
-            numpy.int64: robjects.NA_Integer,
-            numpy.object_: robjects.NA_Character,
-            numpy.str: robjects.NA_Character,
-            numpy.bool: robjects.NA_Logical}
-
-import rpy2.rlike.container as rlc
-
-def rpy2DataFrameToPandasDataFrame(rdf):
-    recarray = numpy.transpose(numpy.asarray(rdf))
-    df = pandas.DataFrame.from_records(recarray, index=list(rdf.rownames), columns=list(rdf.colnames))
+# R's missing value sentinels, as they are laid out in the memory of an R vector
+NA_REAL_BITS = numpy.int64(0x7FF00000000007A2)
+NA_INTEGER = numpy.iinfo(numpy.int32).min
+
+INT32_RANGE = (numpy.iinfo(numpy.int32).min + 1, numpy.iinfo(numpy.int32).max)
+
+
+def _fromBuffer(sexpclass, vectorclass, values):
+    """ Builds an R vector from a contiguous numpy array whose dtype already matches
+    the memory layout of the R vector type (float64 for REALSXP, int32 for INTSXP/LGLSXP).
+    With rpy2 >= 3 this is a single memcpy; older versions fall back to the sequence 
+    constructor """
+    if hasattr(sexpclass, "from_memoryview"):
+        return vectorclass(sexpclass.from_memoryview(memoryview(values)))
+    return vectorclass(sexpclass(values))
+
+def _setAttribute(vector, name, value):
+    """ Sets an attribute directly on the SEXP, without evaluating any R code """
+    vector.do_slot_assign(name, value)
+
+def _markAsIs(vector):
+    """ Equivalent to calling I() in R, which just prepends 'AsIs' to the class attribute """
+    try:
+        oldclass = list(vector.do_slot("class"))
+    except LookupError:
+        oldclass = []
+    _setAttribute(vector, "class", rinterface.StrSexpVector(["AsIs"] + oldclass))
+    return vector
+
+# numpy dtypes whose memory layout matches an R vector type exactly
+R_BUFFER_DTYPES = {"f": numpy.dtype(numpy.float64),
+                   "i": numpy.dtype(numpy.int32),
+                   "u": numpy.dtype(numpy.int32),
+                   "b": numpy.dtype(numpy.int32)}
+
+def needsCopy(values):
+    """ Returns True if the 1-d numpy array can't be handed to R directly from its own
+    buffer, ie if it first has to be cast or made contiguous in an intermediate numpy copy """
+    dtype = R_BUFFER_DTYPES.get(values.dtype.kind)
+    if dtype is None:
+        return True
+    return values.dtype != dtype or not values.flags.c_contiguous
+
+def _typedBuffer(values, dtype, mask):
+    """ Returns values as a contiguous array of the given dtype, only copying if the 
+    dtype or layout differs, or if NAs need to be written without touching the input """
+    buf = numpy.ascontiguousarray(values, dtype=dtype)
+    if mask is not None and mask.any():
+        if numpy.may_share_memory(buf, values):
+            buf = buf.copy()
+        if dtype == numpy.float64:
+            buf.view(numpy.int64)[mask] = NA_REAL_BITS
+        else:
+            buf[mask] = NA_INTEGER
+    return buf
+
+def arrayToRVector(values, mask=None, allowCopy=True):
+    """
+    Convert a 1-d numpy array to an R vector, choosing the R type from the dtype.
+
+    Contiguous float64 and int32 arrays without missing values are written into R memory
+    straight from their own buffer (a single memcpy); anything else, including every bool
+    array (R logicals are stored as int32), is first cast in numpy (see :func:`needsCopy`).
+
+    Args:
+        values: a 1-d numpy array
+        mask: an optional boolean array, True where values are missing; these become NA in R
+        allowCopy: if False, raise a ValueError instead of making an intermediate copy
+
+    Returns:
+        An R vector, or None if the dtype has no direct R equivalent
+    """
+    kind = values.dtype.kind
+    hasNA = mask is not None and mask.any()
+
+    if not allowCopy and (hasNA or needsCopy(values)):
+        raise ValueError("converting array of dtype {} to R requires a copy".format(values.dtype))
+
+    if kind in "iu":
+        if len(values) == 0 or (values.min() >= INT32_RANGE[0] and values.max() <= INT32_RANGE[1]):
+            buf = _typedBuffer(values, numpy.int32, mask)
+            return _fromBuffer(rinterface.IntSexpVector, robjects.IntVector, buf)
+        # doesn't fit in an R integer
+        kind = "f"
+
+    if kind == "f":
+        buf = _typedBuffer(values, numpy.float64, mask)
+        return _fromBuffer(rinterface.FloatSexpVector, robjects.FloatVector, buf)
+
+    if kind == "b":
+        buf = _typedBuffer(values, numpy.int32, mask)
+        return _fromBuffer(rinterface.BoolSexpVector, robjects.BoolVector, buf)
+
+    if kind == "M":
+        return datetimeToRPOSIXct(values)
+    if kind == "m":
+        return timedeltaToRDifftime(values)
+
+    if kind in "OUS":
+        strings = numpy.array(values, dtype=object)
+        if hasNA:
+            strings[~mask] = strings[~mask].astype(str)
+            strings[mask] = robjects.NA_Character
+        else:
+            strings[:] = strings.astype(str)
+        return robjects.StrVector(strings)
+
+    return None
+
+def factorFromCodes(codes, levels, ordered=False):
+    """ Builds an R factor from 0-based integer codes (-1 for missing) and the level labels,
+    so that only one string per level has to be created in R """
+    codes = numpy.asarray(codes, dtype=numpy.int32)
+    factor = arrayToRVector(codes + 1, codes < 0)
+    _setAttribute(factor, "levels", robjects.StrVector(numpy.asarray(levels).astype(str)))
+    rclass = ["ordered", "factor"] if ordered else ["factor"]
+    _setAttribute(factor, "class", rinterface.StrSexpVector(rclass))
+    return robjects.FactorVector(factor)
+
+def categoricalToRFactor(values):
+    """ Convert a pandas Categorical (or a Series with category dtype) to an R factor """
+    if isinstance(values, pandas.Series):
+        values = values.values
+    return factorFromCodes(values.codes, values.categories, values.ordered)
+
+def stringsToRFactor(values, maxLevels=None):
+    """
+    Convert an array or Series of strings to an R factor, with levels in sorted order.
+
+    Args:
+        values: the strings to convert
+        maxLevels: if given, return None instead of a factor when there are more distinct
+            values than this
+
+    Returns:
+        An R factor, or None
+    """
+    codes, levels = pandas.factorize(values, sort=True)
+    if maxLevels is not None and len(levels) > maxLevels:
+        return None
+    return factorFromCodes(codes, levels)
+
+## DATES AND TIMES
+
+NAT = numpy.iinfo(numpy.int64).min
+DIFFTIME_UNITS = {"secs": 1, "mins": 60, "hours": 3600, "days": 86400, "weeks": 7*86400}
+
+def _setClass(vector, rclass):
+    _setAttribute(vector, "class", rinterface.StrSexpVector(rclass))
+    return vector
+
+def _rclass(vector):
+    """ The class attribute of an R object (without calling class() in R) """
+    try:
+        return list(vector.do_slot("class"))
+    except LookupError:
+        return []
+
+# marks POSIXct vectors made from naive datetimes, so that they come back naive
+NAIVE_ATTRIBUTE = "biorpy.naive"
+
+def datetimeToRPOSIXct(values):
+    """ Convert datetime64 values (a numpy array, or a pandas Series/Index, which may be
+    timezone-aware) to an R POSIXct vector. Naive times are treated as UTC, so that the 
+    wall-clock times are unchanged in R, and are marked so that :func:`rTimesToArray` 
+    turns them back into naive times. """
+    tz = getattr(values.dtype, "tz", None)
+    if isinstance(values, (pandas.Series, pandas.Index)):
+        # for timezone-aware data this gives the underlying UTC times
+        values = values.values
+    values = numpy.asarray(values, dtype="datetime64[ns]")
+
+    seconds = values.view(numpy.int64) / 1e9
+    vector = arrayToRVector(seconds, numpy.isnat(values))
+
+    _setClass(vector, ["POSIXct", "POSIXt"])
+    _setAttribute(vector, "tzone", rinterface.StrSexpVector([str(tz) if tz is not None else "UTC"]))
+    if tz is None:
+        _setAttribute(vector, NAIVE_ATTRIBUTE, rinterface.BoolSexpVector([True]))
+    return vector
+
+def timedeltaToRDifftime(values):
+    """ Convert timedelta64 values to an R difftime vector, in seconds """
+    values = numpy.asarray(values, dtype="timedelta64[ns]")
+
+    seconds = values.view(numpy.int64) / 1e9
+    vector = arrayToRVector(seconds, numpy.isnat(values))
+
+    _setClass(vector, ["difftime"])
+    _setAttribute(vector, "units", rinterface.StrSexpVector(["secs"]))
+    return vector
+
+def datesToRDate(values):
+    """ Convert dates (datetime.date objects or datetime64 values) to an R Date vector """
+    values = numpy.asarray(values, dtype="datetime64[D]")
+
+    days = values.view(numpy.int64).astype(numpy.float64)
+    vector = arrayToRVector(days, numpy.isnat(values))
+
+    return _setClass(vector, ["Date"])
+
+def _timeSeriesToR(series):
+    """ Converts datetime-like Series to the matching R class, or returns None """
+    dtype = series.dtype
+    if dtype.kind == "M":
+        return datetimeToRPOSIXct(series)
+    if dtype.kind == "m":
+        return timedeltaToRDifftime(series)
+    if isinstance(dtype, pandas.PeriodDtype):
+        # a PeriodIndex has no .dt
+        timestamps = series.to_timestamp() if isinstance(series, pandas.Index) else series.dt.to_timestamp()
+        if dtype.freq.freqstr == "D":
+            return datesToRDate(timestamps)
+        return datetimeToRPOSIXct(timestamps)
+    if dtype.kind == "O" and pandas.api.types.infer_dtype(series, skipna=True) == "date":
+        return datesToRDate(series)
+    return None
+
+def _seriesValues(series):
+    """ The values of a Series as a numpy array, and a boolean array that is True where they
+    are missing. Nullable dtypes (eg "boolean", "Int64") give an array of their numpy dtype. """
+    mask = numpy.asarray(series.isna())
+    dtype = series.dtype
+    if isinstance(dtype, pandas.api.extensions.ExtensionDtype) and dtype.kind in "biuf":
+        # the NAs are written from the mask
+        fill = numpy.nan if dtype.kind == "f" else 0
+        return series.to_numpy(dtype=dtype.numpy_dtype, na_value=fill), mask
+    return numpy.asarray(series), mask
+
+def seriesToRVector(series, asis=False):
+    """ Convert a pandas Series to an R vector, with nulls becoming NAs. Categorical
+    Series become factors, and datetimes, timedeltas, periods and dates become 
+    POSIXct, difftime or Date vectors. """
+    if series.dtype.name == "category":
+        return categoricalToRFactor(series)
+
+    vector = _timeSeriesToR(series)
+    if vector is not None:
+        if asis:
+            _markAsIs(vector)
+        return vector
+
+    values, mask = _seriesValues(series)
+    vector = arrayToRVector(values, mask)
+    if vector is None:
+        raise TypeError("Don't know how to convert dtype {} to R".format(series.dtype))
+    if asis:
+        _markAsIs(vector)
+    return vector
+
+## MATRICES
+
+def _dimnames(*names):
+    return rinterface.ListSexpVector(
+        [rinterface.NULL if n is None else robjects.StrVector(numpy.asarray(n).astype(str))
+         for n in names])
+
+def arrayToRMatrix(values, rownames=None, colnames=None):
+    """
+    Convert a numpy array with 2 (or more) dimensions to an R matrix (or array).
+
+    R stores matrices in column-major order, so Fortran-ordered arrays are transferred 
+    directly from their buffer; C-ordered arrays are transposed into a single copy first.
+
+    Args:
+        values: the numpy array
+        rownames, colnames: optional dimnames (2-d arrays only)
+
+    Returns:
+        An R matrix, or None if the dtype has no direct R equivalent
+    """
+    flat = values.ravel(order="F")
+    mask = pandas.isnull(flat) if flat.dtype.kind == "O" else None
+    matrix = arrayToRVector(flat, mask)
+    if matrix is None:
+        return None
+
+    _setAttribute(matrix, "dim", rinterface.IntSexpVector(values.shape))
+    if rownames is not None or colnames is not None:
+        _setAttribute(matrix, "dimnames", _dimnames(rownames, colnames))
+
+    if values.ndim == 2:
+        return robjects.vectors.Matrix(matrix)
+    return robjects.vectors.Array(matrix)
+
+def dataFrameToRMatrix(df):
+    """ Convert a pandas DataFrame to an R matrix with the index and columns as dimnames,
+    without going through an R data.frame. All the columns should have the same dtype; 
+    otherwise, the result is a character matrix (like as.matrix() in R) """
+    # for a single-dtype frame this is a column-major view of pandas' own storage
+    values = df.values
+    return arrayToRMatrix(values, rownames=df.index, colnames=df.columns)
+
+## SPARSE MATRICES
+
+def _isSparse(obj):
+    # if scipy.sparse hasn't been imported, obj can't be a sparse matrix
+    sparse = sys.modules.get("scipy.sparse")
+    return sparse is not None and sparse.issparse(obj)
+
+_matrixPackage = {}
+
+def _newMatrix(rclass, **slots):
+    """ Calls methods::new() to build a Matrix object, loading the Matrix namespace the 
+    first time it's needed """
+    if not _matrixPackage:
+        robjects.r("suppressPackageStartupMessages(requireNamespace('Matrix'))")
+        _matrixPackage["new"] = robjects.r("methods::new")
+    return _matrixPackage["new"](rclass, **slots)
+
+def _indexVector(values):
+    return arrayToRVector(numpy.asarray(values, dtype=numpy.int32))
+
+def sparseToRMatrix(matrix, rownames=None, colnames=None):
+    """
+    Convert a scipy.sparse matrix to a sparse matrix from R's Matrix package, without 
+    making it dense. CSR matrices become dgRMatrix objects; everything else (CSC, COO, ...)
+    becomes a dgCMatrix.
+
+    Args:
+        matrix: the scipy.sparse matrix
+        rownames, colnames: optional dimnames
+
+    Returns:
+        An R dgCMatrix or dgRMatrix
+    """
+    if matrix.format == "csr":
+        rclass, indexSlot = "dgRMatrix", "j"
+    else:
+        matrix = matrix.tocsc()
+        rclass, indexSlot = "dgCMatrix", "i"
+
+    # the Matrix classes require sorted indices without duplicates
+    if not matrix.has_canonical_format:
+        matrix = matrix.copy()
+        matrix.sum_duplicates()
+
+    slots = {indexSlot: _indexVector(matrix.indices),
+             "p": _indexVector(matrix.indptr),
+             "x": arrayToRVector(numpy.asarray(matrix.data, dtype=numpy.float64)),
+             "Dim": _indexVector(matrix.shape)}
+
+    if rownames is not None or colnames is not None:
+        slots["Dimnames"] = robjects.ListVector(rinterface.ListSexpVector(
+            [rinterface.NULL if names is None else convertToR(list(map(str, names)))
+             for names in (rownames, colnames)]))
+
+    return _newMatrix(rclass, **slots)
+
+SPARSE_RCLASSES = {"dgCMatrix": "csc", "dgRMatrix": "csr", "dgTMatrix": "coo"}
+
+def isSparseRMatrix(obj):
+    if not isinstance(obj, robjects.methods.RS4):
+        return False
+    rclass = _rclass(obj)
+    return len(rclass) > 0 and rclass[0] in SPARSE_RCLASSES
+
+def rSparseToScipy(obj):
+    """ Convert a dgCMatrix, dgRMatrix or dgTMatrix from R to the equivalent scipy.sparse
+    matrix, straight from the index and value slots """
+    import scipy.sparse
+
+    def slot(name, dtype):
+        return _bufferView(obj.do_slot(name), dtype).copy()
+
+    kind = SPARSE_RCLASSES[_rclass(obj)[0]]
+    shape = tuple(slot("Dim", numpy.int32))
+    x = slot("x", numpy.float64)
+
+    if kind == "csc":
+        return scipy.sparse.csc_matrix((x, slot("i", numpy.int32), slot("p", numpy.int32)), shape=shape)
+    elif kind == "csr":
+        return scipy.sparse.csr_matrix((x, slot("j", numpy.int32), slot("p", numpy.int32)), shape=shape)
+    else:
+        return scipy.sparse.coo_matrix((x, (slot("i", numpy.int32), slot("j", numpy.int32))), shape=shape)
+
+def _makeDataFrame(columns, names, rownames=None):
+    """ Assembles already-converted R vectors into an R data.frame by setting the 
+    list attributes directly, rather than going through R's data.frame() """
+    rlist = rinterface.ListSexpVector(columns)
+
+    # match data.frame()'s check.names=TRUE
+    names = robjects.baseenv["make.names"](robjects.StrVector(names), unique=True)
+    _setAttribute(rlist, "names", names)
+    _setAttribute(rlist, "class", rinterface.StrSexpVector(["data.frame"]))
+    _setAttribute(rlist, "row.names", rownames)
+
+    return robjects.DataFrame(rlist)
+
+
+def _bufferView(vector, dtype):
+    """ A numpy view onto the memory of an R vector, without copying, where rpy2 allows it """
+    if hasattr(vector, "memoryview"):
+        return numpy.frombuffer(vector.memoryview(), dtype=dtype)
+    return numpy.asarray(vector).view(dtype)
+
+def _isNA(vector):
+    # keeps a reference to the R result while the view onto it is being copied
+    isna = robjects.baseenv["is.na"](vector)
+    return _bufferView(isna, numpy.int32).astype(bool)
+
+def _nanosFrom(values, scale):
+    """ Scales float values to integer nanoseconds, with NaN/NA becoming NaT """
+    values = numpy.asarray(values, dtype=numpy.float64)
+    mask = numpy.isnan(values)
+    nanos = numpy.round(values * scale * 1e9).astype(numpy.int64)
+    nanos[mask] = NAT
+    return nanos
+
+def rTimesToArray(vector):
+    """
+    Convert an R POSIXct, Date or difftime vector to pandas/numpy datetimes or timedeltas.
+
+    POSIXct vectors with a tzone attribute become timezone-aware DatetimeArrays; Dates,
+    POSIXct without a timezone and POSIXct converted from naive python datetimes become 
+    naive datetime64[ns] arrays; difftimes become timedelta64[ns] arrays.
+
+    Returns:
+        The converted array, or None if the vector isn't one of these classes
+    """
+    rclass = _rclass(vector)
+    if not rclass:
+        return None
+
+    if "POSIXct" in rclass or "Date" in rclass or "difftime" in rclass:
+        if isinstance(vector, robjects.vectors.FloatVector):
+            values = _bufferView(vector, numpy.float64)
+        else:
+            values = _bufferView(vector, numpy.int32).astype(numpy.float64)
+            values[values == NA_INTEGER] = numpy.nan
+    else:
+        return None
+
+    if "POSIXct" in rclass:
+        times = _nanosFrom(values, 1).view("datetime64[ns]")
+        try:
+            tz = vector.do_slot("tzone")[0]
+        except LookupError:
+            tz = ""
+        try:
+            naive = bool(vector.do_slot(NAIVE_ATTRIBUTE)[0])
+        except LookupError:
+            naive = False
+        if tz and not naive:
+            return pandas.DatetimeIndex(times).tz_localize("UTC").tz_convert(tz).array
+        return times
+
+    if "Date" in rclass:
+        return _nanosFrom(values, 86400).view("datetime64[ns]")
+
+    units = vector.do_slot("units")[0]
+    return _nanosFrom(values, DIFFTIME_UNITS[units]).view("timedelta64[ns]")
+
+def rVectorToArray(vector, copy=True):
+    """
+    Convert an atomic R vector to a numpy array (or pandas array for types numpy can't represent).
+
+    doubles become float64 (NA -> NaN), integers become int32 and logicals bool (or pandas' nullable
+    Int32/boolean arrays if there are NAs), characters become object arrays (NA -> None), 
+    factors become pandas Categoricals, and dates and times are converted by :func:`rTimesToArray`.
+
+    Args:
+        vector: an rpy2 vector
+        copy: if False, numeric results may be views onto the R vector's memory, which are
+            only valid while the R object is alive and must not be modified
+
+    Returns:
+        The converted array, or None if the vector type isn't handled
+    """
+    if isinstance(vector, robjects.vectors.FactorVector):
+        raw = _bufferView(vector, numpy.int32)
+        # NA_INTEGER is int32's minimum, so mask it before subtracting 1 would wrap it around
+        codes = raw - 1
+        codes[raw == NA_INTEGER] = -1
+        ordered = "ordered" in _rclass(vector)
+        return pandas.Categorical.from_codes(codes, categories=list(vector.levels), ordered=ordered)
+
+    times = rTimesToArray(vector)
+    if times is not None:
+        return times
+
+    if isinstance(vector, robjects.vectors.FloatVector):
+        values = _bufferView(vector, numpy.float64)
+        return values.copy() if copy else values
+
+    if isinstance(vector, (robjects.vectors.IntVector, robjects.vectors.BoolVector)):
+        values = _bufferView(vector, numpy.int32)
+        mask = values == NA_INTEGER
+        if isinstance(vector, robjects.vectors.BoolVector):
+            values = values.astype(bool)
+            if mask.any():
+                return pandas.arrays.BooleanArray(values, mask)
+            return values
+
+        if mask.any():
+            return pandas.arrays.IntegerArray(values.copy(), mask)
+        return values.copy() if copy else values
+
+    if isinstance(vector, robjects.vectors.StrVector):
+        values = numpy.array(list(vector), dtype=object)
+        mask = _isNA(vector)
+        if mask.any():
+            values[mask] = None
+        return values
+
+    return None
+
+## ROW NAMES AND INDEXES
+
+# data.frame attributes recording which leading columns hold the levels of a MultiIndex
+INDEX_ATTRIBUTE = "biorpy.index"
+INTERACTION_ATTRIBUTE = "biorpy.interaction"
+# and, for an interaction factor, the values of each level of the MultiIndex for each factor level
+INTERACTION_LEVELS_ATTRIBUTE = "biorpy.interaction.levels"
+
+def automaticRowNames(nrows):
+    """ R's compact representation of the row names 1..nrows, which takes no memory """
+    return rinterface.IntSexpVector([NA_INTEGER, -nrows])
+
+def _isDefaultIndex(index):
+    return isinstance(index, pandas.RangeIndex) and index.start == 0 and index.step == 1
+
+def _levelNames(index):
+    return robjects.StrVector([robjects.NA_Character if name is None else str(name) 
+                               for name in index.names])
+
+def _indexToR(index, multiindex_as="columns"):
+    """
+    Works out how to represent a pandas index in an R data.frame.
+
+    Returns:
+        (key columns, their names, row names, extra data.frame attributes)
+    """
+    if isinstance(index, pandas.MultiIndex):
+        names = [str(name) if name is not None else "level_{}".format(i) 
+                 for i, name in enumerate(index.names)]
+        if multiindex_as == "factor":
+            codes, uniques = pandas.factorize(index)
+            labels = [":".join(map(str, key)) for key in uniques]
+            factor = factorFromCodes(codes, labels)
+            levels = rinterface.ListSexpVector([seriesToRVector(uniques.get_level_values(i).to_series())
+                                                for i in range(index.nlevels)])
+            return [factor], [".".join(names)], automaticRowNames(len(index)), \
+                {INTERACTION_ATTRIBUTE: _levelNames(index), INTERACTION_LEVELS_ATTRIBUTE: levels}
+        columns = [seriesToRVector(index.get_level_values(i).to_series()) for i in range(index.nlevels)]
+        return columns, names, automaticRowNames(len(index)), {INDEX_ATTRIBUTE: _levelNames(index)}
+
+    if _isDefaultIndex(index):
+        return [], [], automaticRowNames(len(index)), {}
+
+    if not index.is_unique:
+        # R doesn't allow duplicated row names, so keep the index as a column instead
+        name = "index" if index.name is None else str(index.name)
+        return [seriesToRVector(index.to_series())], [name], automaticRowNames(len(index)), \
+            {INDEX_ATTRIBUTE: _levelNames(index)}
+
+    if index.dtype.kind in "iu":
+        rownames = arrayToRVector(numpy.asarray(index))
+        if isinstance(rownames, robjects.vectors.IntVector):
+            return [], [], rownames, {}
+
+    return [], [], robjects.StrVector(numpy.asarray(index).astype(str)), {}
+
+def _rowNamesToIndex(rdf):
+    """ Rebuilds the index from the row names of an R data.frame, without expanding R's 
+    automatic row names into strings """
+    nrows = robjects.baseenv[".row_names_info"](rdf, type=1)[0]
+    if nrows < 0:
+        return pandas.RangeIndex(-nrows)
+
+    rownames = rdf.do_slot("row.names")
+    if isinstance(rownames, rinterface.IntSexpVector):
+        return pandas.Index(_bufferView(rownames, numpy.int32).copy())
+    return pandas.Index(list(rownames))
+
+def _restoreIndex(rdf, df):
+    """ Moves MultiIndex key columns (see :func:`_indexToR`) back into the index """
+    for attribute in (INDEX_ATTRIBUTE, INTERACTION_ATTRIBUTE):
+        try:
+            levelNames = [None if name is rinterface.NA_Character else name 
+                          for name in rdf.do_slot(attribute)]
+            break
+        except LookupError:
+            pass
+    else:
+        return df
+
+    if attribute == INDEX_ATTRIBUTE:
+        df = df.set_index(list(df.columns[:len(levelNames)]))
+    else:
+        # the labels of the factor are only for display; the keys are rebuilt from its codes
+        codes = numpy.asarray(df.iloc[:, 0].cat.codes)
+        levels = []
+        for values in rdf.do_slot(INTERACTION_LEVELS_ATTRIBUTE):
+            converted = rVectorToArray(values)
+            levels.append(pandas.Index(converted if converted is not None else list(values)))
+        df = df.iloc[:, 1:]
+        df.index = pandas.MultiIndex.from_arrays([level.take(codes) for level in levels])
+    df.index.names = levelNames
     return df
 
-def pandasDataFrameToRPy2DataFrame(df, strings_as_factors=False):
+def rpy2DataFrameToPandasDataFrame(rdf, copy=True):
+    """
+    Convert an R data.frame to a pandas DataFrame, one column at a time so that each column 
+    keeps a native dtype (see :func:`rVectorToArray`).
+
+    R's automatic row names become a RangeIndex, and MultiIndexes written by 
+    :func:`pandasDataFrameToRPy2DataFrame` are rebuilt.
+
+    Args:
+        rdf: the R data.frame
+        copy: if False, numeric columns may share memory with the R data.frame
+
+    Returns:
+        A pandas DataFrame
+    """
+    columns = {}
+
+    for i, column in enumerate(rdf):
+        converted = rVectorToArray(column, copy=copy)
+        if converted is None:
+            converted = numpy.asarray(column)
+        columns[i] = converted
+
+    df = pandas.DataFrame(columns, index=_rowNamesToIndex(rdf), copy=False)
+    df.columns = list(rdf.colnames)
+    return _restoreIndex(rdf, df)
+
+def pandasDataFrameToRPy2DataFrame(df, strings_as_factors=False, factor_threshold=None, multiindex_as="columns"):
     """
     Convert a pandas DataFrame to a R data.frame.
 
+    Categorical columns always become factors, built from the category codes.
+
+    A default RangeIndex becomes R's compact automatic row names, and other unique integer
+    indexes become integer row names. A MultiIndex (or an index with duplicates, which R
+    doesn't allow as row names) is added as leading key columns.
 
     Args:        
         df: The DataFrame being converted
         strings_as_factors: Whether to turn strings into R factors (default: False)
+        factor_threshold: if given, string columns whose number of distinct values is at most
+            this fraction of the number of rows become factors, even if strings_as_factors is False
+        multiindex_as: "columns" to add one key column per MultiIndex level, or "factor" to
+            add a single interaction factor instead (labelled "a:b"; the values of each level
+            are kept in an attribute, so that the index can be rebuilt with its dtypes)
 
     Returns:
         An R data.frame
 
     """
 
-    columns = rlc.OrdDict()
+    columns, names, rownames, attributes = _indexToR(df.index, multiindex_as)
 
-    # FIXME: This doesn't handle MultiIndex
+    for i in range(df.shape[1]):
+        value = df.iloc[:, i]
 
-    for column in df:
-        value = df[column]
-        value_type = value.dtype.type
+        factor = None
+        if value.dtype.name == "category":
+            factor = categoricalToRFactor(value)
+        elif value.dtype.kind in "OUS":
+            if strings_as_factors:
+                factor = stringsToRFactor(value)
+            elif factor_threshold is not None:
+                factor = stringsToRFactor(value, maxLevels=factor_threshold * len(value))
 
-        if value_type == numpy.datetime64:
-            value = convert_to_r_posixct(value)
+        if factor is not None:
+            value = factor
         else:
-            value = [item if pandas.notnull(item) else NA_TYPES[value_type]
-                     for item in value]
+            value = seriesToRVector(value, asis=not strings_as_factors)
 
-            value = VECTOR_TYPES[value_type](value)
+        columns.append(value)
 
-            if not strings_as_factors:
-                I = robjects.baseenv.get("I")
-                value = I(value)
+    names += [str(column) for column in df.columns]
+    r_dataframe = _makeDataFrame(columns, names, rownames)
+    for name, value in attributes.items():
+        _setAttribute(r_dataframe, name, value)
 
-        columns[column] = value
+    return r_dataframe
 
-    r_dataframe = robjects.DataFrame(columns)
-    r_dataframe.rownames = robjects.StrVector(df.index)
 
-    return r_dataframe
\ No newline at end of file
+# DataFrames passed to convertToR are converted once and reused while unchanged; 
+# use conversionCache.invalidate() to release them or set conversionCache.enabled = False
+conversionCache = caching.ConversionCache(pandasDataFrameToRPy2DataFrame)
@@ -0,0 +1,107 @@
+import asyncio
+import concurrent.futures
+import threading
+
+_active = []
+
+def activeExecutor():
+    """ The running :class:`RExecutor`, if any; while there is one, all handler calls
+    are routed through it """
+    if _active:
+        return _active[0]
+    return None
+
+def runOnRThread(fn, *args, **kwdargs):
+    """ Calls fn(*args, **kwdargs), on the R thread if an :class:`RExecutor` is running """
+    rexecutor = activeExecutor()
+    if rexecutor is not None and not rexecutor.onThread():
+        return rexecutor.submit(fn, *args, **kwdargs).result()
+    return fn(*args, **kwdargs)
+
+def _disableStackCheck():
+    """ R checks its C stack usage against the thread it was started on, which gives spurious
+    'C stack usage is too close to the limit' errors on any other thread """
+    try:
+        from rpy2.rinterface_lib import openrlib
+        openrlib.rlib.R_CStackLimit = openrlib.ffi.cast("uintptr_t", -1)
+    except (ImportError, AttributeError):
+        pass
+
+
+class RExecutor(object):
+    """ Owns the embedded R session on a single dedicated thread. Work submitted from any
+    thread is queued and run there one item at a time, so R is never entered concurrently. """
+
+    def __init__(self):
+        self._thread = None
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            1, thread_name_prefix="biorpy-R", initializer=self._initThread)
+
+    def _initThread(self):
+        self._thread = threading.current_thread()
+        _disableStackCheck()
+
+    def onThread(self):
+        """ True if called from the thread that runs R """
+        return threading.current_thread() is self._thread
+
+    def submit(self, fn, *args, **kwdargs):
+        """ Queues fn(*args, **kwdargs) to run on the R thread; returns a concurrent.futures.Future.
+        (If already on the R thread, fn runs immediately, since waiting would deadlock.) """
+        if self.onThread():
+            future = concurrent.futures.Future()
+            try:
+                future.set_result(fn(*args, **kwdargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        return self._pool.submit(fn, *args, **kwdargs)
+
+    def start(self):
+        if self not in _active:
+            _active.append(self)
+        return self
+
+    def shutdown(self, wait=True):
+        if self in _active:
+            _active.remove(self)
+        self._pool.shutdown(wait=wait)
+
+
+class AsyncHandler(object):
+    """ Awaitable version of a :class:`biorpy.betteR.Handler`. The handler itself is 
+    looked up on the R thread, since that may need to call into R. """
+
+    def __init__(self, betteR, rname, executor):
+        self.betteR = betteR
+        self.rname = rname
+        self.executor = executor
+
+    def _call(self, args, kwdargs):
+        return self.betteR[self.rname](*args, **kwdargs)
+
+    async def __call__(self, *args, **kwdargs):
+        future = self.executor.submit(self._call, args, kwdargs)
+        return await asyncio.wrap_future(future)
+
+
+class AsyncR(object):
+    """ asyncio interface to a :class:`biorpy.betteR.BetteR` instance; ``await r.aio.lm(...)``
+    runs the call on the R thread without blocking the event loop. """
+
+    def __init__(self, betteR, executor):
+        self._betteR = betteR
+        self._executor = executor
+
+    def __getattr__(self, attr):
+        if attr.startswith("__"):
+            raise AttributeError(attr)
+        return AsyncHandler(self._betteR, attr, self._executor)
+
+    def __getitem__(self, attr):
+        return AsyncHandler(self._betteR, attr, self._executor)
+
+    async def __call__(self, string):
+        """ Evaluates a string of R code """
+        future = self._executor.submit(self._betteR, string)
+        return await asyncio.wrap_future(future)
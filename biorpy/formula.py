@@ -1,8 +1,9 @@
 import numpy
 import pandas
 from biorpy import r
-from biorpy import conversion
-from rpy2.robjects import Formula as RPy2Formula
+from biorpy import conversion, executor
+from biorpy.lazymodule import LazyModule
+robjects = LazyModule("rpy2.robjects")
 
 # def getSimpleFormula(x, y):
 #     formula = Formula("y ~ x")
@@ -13,15 +14,23 @@ from rpy2.robjects import Formula as RPy2Formula
 
 class Formula(object):
     def __init__(self, formula, table):
-        self.f = RPy2Formula(formula)
-        for name in table:
-            self.f.environment[name] = conversion.convertToR(table[name])
+        # builds R objects, so has to happen on the R thread
+        executor.runOnRThread(self._build, formula, table)
+
+    def _build(self, formula, table):
+        self.f = robjects.Formula(formula)
         self.table = conversion.convertToR(table)
+        # reuse the converted columns rather than converting each one again; the R version
+        # may start with extra columns holding the index (see conversion._indexToR)
+        names = list(table)
+        columns = list(self.table)[len(self.table) - len(names):]
+        for name, column in zip(names, columns):
+            self.f.environment[name] = column
 
 class Model(object):
     def __init__(self, formula, table):
         self.f = Formula(formula, table)
-        self.lm = r.lm(self.f.f, data=conversion.convertToR(table))
+        self.lm = r.lm(self.f.f, data=self.f.table)
         self._summary = None
         self._coeff = None
         self._residuals = None
@@ -33,20 +42,23 @@ class Model(object):
 
     def coeff(self):
         if self._coeff is None:
-            x = self.summary().rx("coefficients")[0]
-            self._coeff = pandas.DataFrame(numpy.array(x), columns=r.colnames(x), index=r.rownames(x))
+            self._coeff = executor.runOnRThread(self._getCoeff)
         return self._coeff
 
+    def _getCoeff(self):
+        x = self.summary().rx("coefficients")[0]
+        return pandas.DataFrame(numpy.array(x), columns=r.colnames(x), index=r.rownames(x))
+
     def residuals(self):
         if self._residuals is None:
-            self._residuals = numpy.array(self.lm.rx("residuals")[0])
+            self._residuals = executor.runOnRThread(lambda: numpy.array(self.lm.rx("residuals")[0]))
         return self._residuals
 
 
 class GAM(object):
     def __init__(self, formula, table, **gamExtras):
         self.f = Formula(formula, table)
-        self.lm = r.gam(self.f.f, data=conversion.convertToR(table), **gamExtras)
+        self.lm = r.gam(self.f.f, data=self.f.table, **gamExtras)
         self._summary = None
         self._coeff = None
         self._residuals = None
\ No newline at end of file
@@ -0,0 +1,69 @@
+##
+## R helper functions used by biorpy, defined and byte-compiled once per session
+##
+from biorpy.lazymodule import LazyModule
+robjects = LazyModule("rpy2.robjects")
+
+from biorpy import executor
+
+# R packages to load as soon as R starts, eg PRELOAD.append("mgcv") before first using r
+PRELOAD = []
+
+_sources = {}
+_packages = {}
+_compiled = {}
+_environment = []
+_loadedPackages = set()
+
+def register(name, source, packages=()):
+    """ Registers an R helper function; its source is only evaluated the first time it's used
+
+    Args:
+        name: the name used to look up the helper with :func:`get`
+        source: R code evaluating to a function
+        packages: R packages to load before the helper is first used
+    """
+    _sources[name] = source
+    _packages[name] = list(packages)
+    _compiled.pop(name, None)
+    return name
+
+def _getEnvironment():
+    """ The private R environment the helpers are defined in """
+    if not _environment:
+        _environment.append(robjects.baseenv["new.env"](parent=robjects.globalenv))
+    return _environment[0]
+
+def requirePackages(*packages):
+    """ Loads (attaches) R packages; packages already loaded through here are skipped without
+    calling into R """
+    rexecutor = executor.activeExecutor()
+    if rexecutor is not None and not rexecutor.onThread():
+        return rexecutor.submit(requirePackages, *packages).result()
+
+    for package in packages:
+        if package not in _loadedPackages:
+            robjects.r("suppressPackageStartupMessages(library({}))".format(package))
+            _loadedPackages.add(package)
+
+def loadPreloads():
+    requirePackages(*PRELOAD)
+
+def get(name):
+    """ The byte-compiled R function for a registered helper """
+    rexecutor = executor.activeExecutor()
+    if rexecutor is not None and not rexecutor.onThread():
+        return rexecutor.submit(get, name).result()
+
+    if name not in _compiled:
+        if name not in _sources:
+            raise Exception("No R helper named '{}' has been registered".format(name))
+        requirePackages(*_packages[name])
+
+        env = _getEnvironment()
+        function = robjects.baseenv["eval"](robjects.baseenv["parse"](text=_sources[name]), envir=env)
+        function = robjects.r("compiler::cmpfun")(function)
+        # so that helpers can call each other
+        env[name] = function
+        _compiled[name] = function
+    return _compiled[name]
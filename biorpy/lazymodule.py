@@ -0,0 +1,24 @@
+import importlib
+
+
+class LazyModule(object):
+    """ Stands in for a module that is expensive to import (eg rpy2.robjects, which starts
+    R), importing it the first time one of its attributes is used """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        if attr.startswith("__"):
+            raise AttributeError(attr)
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return "<lazy module '{}' ({})>".format(self._name, state)
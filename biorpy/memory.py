@@ -0,0 +1,194 @@
+##
+## keeping track of (and limiting) the memory used by R objects
+##
+import gc
+import os
+import weakref
+
+import numpy
+import pandas
+from biorpy.lazymodule import LazyModule
+robjects = LazyModule("rpy2.robjects")
+
+from biorpy import conversion, executor, refs
+
+# size of an R cons cell (Ncell) on 64-bit platforms; Vcells are 8 bytes
+NCELL_BYTES = 56
+VCELL_BYTES = 8
+
+_active = []
+
+def activeMonitors():
+    """ The running :class:`MemoryMonitor`, :class:`MemoryPolicy` and :class:`MemoryScope`
+    objects (empty unless memory tracking is on) """
+    return _active
+
+def rHeapBytes(full=False):
+    """ Memory in use by R objects, in bytes, according to R's gc(). (This runs a garbage
+    collection: a cheaper, minor one unless full is True.) """
+    result = robjects.baseenv["gc"](full=full)
+    # the "used" column: Ncells, then Vcells
+    usage = conversion._bufferView(result, numpy.float64)
+    return int(usage[0] * NCELL_BYTES + usage[1] * VCELL_BYTES)
+
+def rObjectCounts():
+    """ Number of R objects of each type (from memory.profile()), as a pandas Series """
+    counts = robjects.baseenv["memory.profile"]()
+    return pandas.Series(list(counts), index=list(counts.names), name="count")
+
+def processBytes():
+    """ Resident memory of this process (python and R together), in bytes; None where
+    /proc isn't available """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError):
+        return None
+
+def collect():
+    """ Runs python's garbage collector, and then R's, so that R objects only kept alive by
+    unreachable python wrappers are freed; returns the R heap size afterwards """
+    rexecutor = executor.activeExecutor()
+    if rexecutor is not None and not rexecutor.onThread():
+        return rexecutor.submit(collect).result()
+
+    gc.collect()
+    return rHeapBytes(full=True)
+
+
+class _Tracker(object):
+    def start(self):
+        if self not in _active:
+            _active.append(self)
+        return self
+
+    def stop(self):
+        if self in _active:
+            _active.remove(self)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def callStarted(self, rname):
+        return None
+
+    def callFinished(self, rname, state, rval):
+        pass
+
+
+class MemoryMonitor(_Tracker):
+    """ Records the R heap size before and after each handler call::
+
+        with r.monitorMemory() as monitor:
+            r.lm(formula, data=df)
+        print(monitor.stats())
+
+    Each measurement runs a minor R garbage collection, so this slows calls down. """
+
+    def __init__(self, exporter=None):
+        """
+        Args
+            exporter: optional function called with (rname, bytes before, bytes after) for
+                each call
+        """
+        self.exporter = exporter
+        self.records = []
+
+    def callStarted(self, rname):
+        return rHeapBytes()
+
+    def callFinished(self, rname, before, rval):
+        after = rHeapBytes()
+        self.records.append((rname, before, after))
+        if self.exporter is not None:
+            self.exporter(rname, before, after)
+
+    def stats(self):
+        """ A DataFrame with the R heap size before and after each call, in bytes """
+        stats = pandas.DataFrame(self.records, columns=["rname", "before", "after"])
+        stats["delta"] = stats["after"] - stats["before"]
+        return stats
+
+
+class MemoryPolicy(_Tracker):
+    """ Runs python and R garbage collection (see :func:`collect`) after a handler call once
+    the process uses more than maxBytes of memory, and/or every so many calls. Helps long
+    jobs where R objects are only freed once python gets around to collecting their
+    wrappers. """
+
+    def __init__(self, maxBytes=None, everyCalls=None):
+        """
+        Args
+            maxBytes: collect whenever the process's resident memory is above this
+            everyCalls: collect after this many handler calls
+        """
+        self.maxBytes = maxBytes
+        self.everyCalls = everyCalls
+        self.calls = 0
+        self.collections = 0
+
+    def callFinished(self, rname, state, rval):
+        self.calls += 1
+        due = self.everyCalls is not None and self.calls % self.everyCalls == 0
+        if not due and self.maxBytes is not None:
+            size = processBytes()
+            due = size is not None and size > self.maxBytes
+        if due:
+            collect()
+            self.collections += 1
+
+
+class MemoryScope(_Tracker):
+    """ Frees the R objects created within a ``with`` block::
+
+        with r.memoryScope():
+            for chunk in chunks:
+                fit = r.lm(formula, data=chunk)
+                results.append(fit.py["coefficients"])
+
+    On exit, :class:`biorpy.refs.RRef` handles created in the block are released, cached
+    conversions of DataFrames and the ``.py`` conversions of results made in the block are
+    dropped, and garbage collection is run. R objects that are still referenced from python
+    (eg results assigned to variables outside the block) can't be freed; their number is
+    left in ``.surviving``. """
+
+    def __init__(self, keep=()):
+        """
+        Args
+            keep: RRef handles created in the block that should not be released
+        """
+        self.keep = list(keep)
+        self.surviving = None
+        self._results = []
+
+    def start(self):
+        self._refs = set(refs._live)
+        self._cached = set(conversion.conversionCache._entries)
+        return _Tracker.start(self)
+
+    def callFinished(self, rname, state, rval):
+        try:
+            self._results.append(weakref.ref(rval))
+        except TypeError:
+            pass
+
+    def stop(self):
+        _Tracker.stop(self)
+
+        for ref in set(refs._live) - self._refs:
+            if not any(ref is kept for kept in self.keep):
+                ref.release()
+        for key in set(conversion.conversionCache._entries) - self._cached:
+            conversion.conversionCache._remove(key)
+        for result in self._results:
+            result = result()
+            if result is not None:
+                result.__dict__.pop("py", None)
+        result = None
+
+        collect()
+        self.surviving = sum(1 for result in self._results if result() is not None)
+        self._results = []
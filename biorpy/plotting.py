@@ -10,9 +10,10 @@ import pandas
 import rpy2
 
 #from rpy2.robjects import r
-from biorpy import r, conversion
+from biorpy import r, conversion, helpers
 #import rpy2.robjects.numpy2ri
-from rpy2 import robjects as robj
+from biorpy.lazymodule import LazyModule
+robj = LazyModule("rpy2.robjects")
 from rpy2.rlike.container import TaggedList
 # rpy2.robjects.numpy2ri.activate()
 
@@ -247,60 +248,57 @@ def barPlot(dict_, keysInOrder=None, printCounts=True, ylim=None, *args, **kwdar
     return x
 
 def barPlot2(dataframe, legend=False, legendWhere="topright", **kwdArgs):
-    rdf = conversion.pandasDataFrameToRPy2DataFrame(dataframe)
+    matrix = conversion.dataFrameToRMatrix(dataframe)
     if legend:
         kwdArgs["legend.text"] = list(dataframe.index)
         kwdArgs["args.legend"] = robj.ListVector({"x":legendWhere})
     kwdArgs.setdefault("names.arg", list(dataframe.columns))
-    coords = r.barplot(r("as.matrix")(rdf), **kwdArgs)
+    coords = r.barplot(matrix, **kwdArgs)
     return coords
 
 
+PANEL_COR_SOURCE = """
+function(x, y, digits=2, prefix="", cex.cor)
+{
+    usr <- par("usr"); on.exit(par(usr))
+    par(usr = c(0, 1, 0, 1))
+    r <- cor(x, y, method="spearman")
+    scale = abs(r)*0.8+0.2
+    txt <- format(c(r, 0.123456789), digits=digits)[1]
+    txt <- paste(prefix, txt, sep="")
+    if(missing(cex.cor)) cex.cor <- 0.8/strwidth(txt)
+    text(0.5, 0.5, txt, cex = cex.cor * scale+0.2)
+}
+"""
+
+PANEL_HIST_SOURCE = """
+function(x, ...)
+{
+    usr <- par("usr"); on.exit(par(usr))
+    par(usr = c(usr[1:2], 0, 1.5) )
+    h <- hist(x, plot = FALSE)
+    breaks <- h$breaks; nB <- length(breaks)
+    y <- h$counts; y <- y/max(y)
+    rect(breaks[-nB], 0, breaks[-1], y, col="lightgrey", ...)
+}
+"""
+
+helpers.register("panel.cor", PANEL_COR_SOURCE, packages=["lattice"])
+helpers.register("panel.hist", PANEL_HIST_SOURCE, packages=["lattice"])
+
 def scatterplotMatrix(dataFrame, main="", **kwdargs):
     """ Plots a scatterplot matrix, with scatterplots in the upper left and correlation
     values in the lower right. Input is a pandas DataFrame.
     """
-    r.library("lattice")
-
     if isinstance(dataFrame, pandas.core.frame.DataFrame):
         df = dataFrame
     else:
         taggedList = TaggedList(list(map(robj.FloatVector, [dataFrame[col] for col in dataFrame.columns])), dataFrame.columns)
         df = robj.DataFrame(taggedList)
 
-    #print taggedList
-    #df = robj.r['data.frame'](**datapointsDict)
-    #df = robj.r['data.frame'](taggedList)
-    #print df
-    #robj.r.splom(df)
-    #robj.r.pairs(df)
-
-    r("""panel.cor <- function(x, y, digits=2, prefix="", cex.cor)
-    {
-        usr <- par("usr"); on.exit(par(usr))
-        par(usr = c(0, 1, 0, 1))
-        r <- cor(x, y, method="spearman")
-        scale = abs(r)*0.8+0.2
-        txt <- format(c(r, 0.123456789), digits=digits)[1]
-        txt <- paste(prefix, txt, sep="")
-        if(missing(cex.cor)) cex.cor <- 0.8/strwidth(txt)
-        text(0.5, 0.5, txt, cex = cex.cor * scale+0.2)
-    }
-    """)
-    r("""panel.hist <- function(x, ...)
-    {
-        usr <- par("usr"); on.exit(par(usr))
-        par(usr = c(usr[1:2], 0, 1.5) )
-        h <- hist(x, plot = FALSE)
-        breaks <- h$breaks; nB <- length(breaks)
-        y <- h$counts; y <- y/max(y)
-        rect(breaks[-nB], 0, breaks[-1], y, col="lightgrey", ...)
-    }""")
-                                        
-
     additionalParams = {"upper.panel": r["panel.smooth"]._robject, 
-                        "lower.panel": r["panel.cor"]._robject, 
-                        "diag.panel": r["panel.hist"]._robject}
+                        "lower.panel": helpers.get("panel.cor"), 
+                        "diag.panel": helpers.get("panel.hist")}
     additionalParams.update(kwdargs)
     r.pairs(df, main=main, **additionalParams)
 
@@ -334,9 +332,14 @@ def plotMatrixAsImage(mat, x1=None, y1=None, x2=None, y2=None, maxval=None, main
         print(x1, x2, y1, y2)
     r.plot([0], xlim=[x1,x2], ylim=[y1,y2], type="n", main=main)
 
+    if isinstance(mat, pandas.DataFrame):
+        rmat = conversion.dataFrameToRMatrix(mat)
+    else:
+        rmat = conversion.arrayToRMatrix(numpy.asarray(mat))
+
     if maxval is None:
-        maxval = mat.max()
-    r.rasterImage(r["as.raster"](mat, max=maxval), x1, y1, x2, y2)
+        maxval = numpy.nanmax(numpy.asarray(mat))
+    r.rasterImage(r["as.raster"](rmat, max=maxval), x1, y1, x2, y2)
 
 
 def dotplots(data, groups=None, **kwdargs):
@@ -0,0 +1,168 @@
+import concurrent.futures
+import multiprocessing
+
+import numpy
+import pandas
+from biorpy.lazymodule import LazyModule
+robjects = LazyModule("rpy2.robjects")
+rinterface = LazyModule("rpy2.rinterface")
+
+from biorpy import conversion, executor
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # python < 3.8: numeric arrays are pickled instead
+    shared_memory = None
+
+
+class _SharedArray(object):
+    """ A numeric array passed to a worker through shared memory instead of being pickled """
+
+    def __init__(self, values, asSeries=False):
+        values = numpy.ascontiguousarray(values)
+        self.shape = values.shape
+        self.dtype = values.dtype.str
+        self.asSeries = asSeries
+
+        self._shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        self.name = self._shm.name
+        numpy.ndarray(self.shape, dtype=values.dtype, buffer=self._shm.buf)[...] = values
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_shm"]
+        return state
+
+    def convert(self):
+        """ (in the worker) converts the shared data straight into R """
+        shm = shared_memory.SharedMemory(name=self.name)
+        values = numpy.ndarray(self.shape, dtype=numpy.dtype(self.dtype), buffer=shm.buf)
+        try:
+            if self.asSeries:
+                values = pandas.Series(values, copy=False)
+            return conversion.convertToR(values)
+        finally:
+            # the R vector holds its own copy; views must be gone before closing
+            values = None
+            shm.close()
+
+    def release(self):
+        """ (in the parent) frees the shared memory """
+        self._shm.close()
+        self._shm.unlink()
+
+
+def _share(arg, threshold):
+    if shared_memory is None:
+        return arg
+    # only plain numpy dtypes; the extension arrays of nullable pandas dtypes hold python objects
+    if not isinstance(arg, (pandas.Series, numpy.ndarray)) or not isinstance(arg.dtype, numpy.dtype):
+        return arg
+    if arg.dtype.kind in "fiub" and arg.nbytes >= threshold:
+        return _SharedArray(numpy.asarray(arg), asSeries=isinstance(arg, pandas.Series))
+    return arg
+
+def _unshare(arg):
+    if isinstance(arg, _SharedArray):
+        return arg.convert()
+    return arg
+
+def _work(rname, args, kwdargs):
+    """ Runs in the worker process; returns the R result serialized by R """
+    from biorpy import r
+
+    args = [_unshare(arg) for arg in args]
+    kwdargs = dict((key, _unshare(value)) for key, value in kwdargs.items())
+    rval = r[rname](*args, **kwdargs)
+
+    return bytes(robjects.baseenv["serialize"](rval, rinterface.NULL))
+
+
+class PoolResult(object):
+    """ The pending result of a call submitted to an :class:`RPool`. The R object is only
+    unserialized (in the calling thread) when :meth:`result` is called. """
+
+    def __init__(self, future, shared, wrapResults):
+        self._future = future
+        self._shared = shared
+        self._wrapResults = wrapResults
+        self._value = None
+        self._done = False
+
+        future.add_done_callback(self._release)
+
+    def _release(self, future):
+        for shared in self._shared:
+            shared.release()
+        self._shared = []
+
+    def done(self):
+        return self._future.done()
+
+    def result(self, timeout=None):
+        if not self._done:
+            data = self._future.result(timeout)
+            self._value = executor.runOnRThread(self._unserialize, data)
+            self._done = True
+        return self._value
+
+    def _unserialize(self, data):
+        rval = robjects.baseenv["unserialize"](rinterface.ByteSexpVector(data))
+        if self._wrapResults and conversion.WRAP_RESULTS:
+            conversion.addResultWrapper(rval)
+        return rval
+
+
+class RPool(object):
+    """ A set of worker processes, each running its own embedded R, for running independent
+    R calls in parallel::
+
+        pool = r.pool(8)
+        results = pool.starmap("wilcox.test", [(a, b) for a, b in pairs])
+        pvalues = [result.py.pvalue for result in results]
+
+    Arguments are converted in the workers; large numeric arrays and Series are passed
+    through shared memory rather than pickled. The workers use the default handlers, so
+    custom handlers added to the parent's ``r`` aren't available to them. """
+
+    def __init__(self, processes=None, shareThreshold=2**16, wrapResults=True):
+        """
+        Args
+            processes: number of worker processes (defaults to the number of cores)
+            shareThreshold: numeric arrays at least this many bytes go through shared memory
+            wrapResults: whether results get the ``.py`` attribute
+        """
+        # R can't be safely forked once it's running, so always start fresh interpreters
+        context = multiprocessing.get_context("spawn")
+        self._executor = concurrent.futures.ProcessPoolExecutor(processes, mp_context=context)
+        self.shareThreshold = shareThreshold
+        self.wrapResults = wrapResults
+
+    def submit(self, rname, *args, **kwdargs):
+        """ Starts running R function rname on the given arguments; returns a :class:`PoolResult` """
+        args = [_share(arg, self.shareThreshold) for arg in args]
+        kwdargs = dict((key, _share(value, self.shareThreshold)) for key, value in kwdargs.items())
+        shared = [arg for arg in list(args) + list(kwdargs.values()) if isinstance(arg, _SharedArray)]
+
+        future = self._executor.submit(_work, rname, args, kwdargs)
+        return PoolResult(future, shared, self.wrapResults)
+
+    def starmap(self, rname, arglist, **kwdargs):
+        """ Calls rname(*args, **kwdargs) for each tuple of args in arglist, in parallel; returns
+        the list of results in order """
+        futures = [self.submit(rname, *args, **kwdargs) for args in arglist]
+        return [future.result() for future in futures]
+
+    def map(self, rname, arglist, **kwdargs):
+        """ Calls rname(arg, **kwdargs) for each arg in arglist, in parallel """
+        return self.starmap(rname, [(arg,) for arg in arglist], **kwdargs)
+
+    def close(self):
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
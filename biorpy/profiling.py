@@ -0,0 +1,128 @@
+import collections
+import time
+
+import pandas
+
+STAGES = ["convert", "call", "wrap", "py"]
+
+# sizes of the elements of R vectors, by SEXP type; used to count argument bytes without
+# calling into R
+SEXP_ITEM_BYTES = {10: 4,   # LGLSXP
+                   13: 4,   # INTSXP
+                   14: 8,   # REALSXP
+                   15: 16,  # CPLXSXP
+                   16: 8,   # STRSXP (pointers to the cached strings)
+                   24: 1}   # RAWSXP
+VECSXP = 19
+
+if hasattr(time, "thread_time"):
+    # R runs on the calling thread, so this includes the time spent in R
+    _cpuTime = time.thread_time
+else:
+    _cpuTime = time.process_time
+
+_active = []
+
+def activeProfilers():
+    """ The list of running :class:`Profiler` objects (empty unless profiling is on) """
+    return _active
+
+def sexpBytes(robj):
+    """ Approximate size of the data in an R vector (recursing into lists), in bytes """
+    try:
+        rtype = int(robj.typeof)
+    except (AttributeError, TypeError, ValueError):
+        return 0
+    if rtype == VECSXP:
+        return sum(sexpBytes(item) for item in robj)
+    return SEXP_ITEM_BYTES.get(rtype, 0) * len(robj)
+
+
+class CallTimer(object):
+    """ Times the stages of one :class:`biorpy.betteR.Handler` call, then reports them to
+    the active profilers """
+
+    def __init__(self, profilers, rname):
+        self.profilers = list(profilers)
+        self.record = {"rname": rname, "argBytes": 0}
+        self._wall = time.perf_counter()
+        self._cpu = _cpuTime()
+
+    def lap(self, stage):
+        """ Ends the given stage (and starts the next one) """
+        wall, cpu = time.perf_counter(), _cpuTime()
+        self.record[stage + "Wall"] = self.record.get(stage + "Wall", 0) + wall - self._wall
+        self.record[stage + "CPU"] = self.record.get(stage + "CPU", 0) + cpu - self._cpu
+        self._wall, self._cpu = wall, cpu
+
+    def countArguments(self, args, kwdargs):
+        self.record["argBytes"] = sum(sexpBytes(arg) for arg in list(args) + list(kwdargs.values()))
+
+    def done(self, calls=1):
+        for profiler in self.profilers:
+            profiler.add(self.record, calls)
+
+
+class Profiler(object):
+    """ Collects per-function statistics about the R calls made through handlers: number
+    of calls, wall and CPU time of each stage and the size of the converted arguments.
+    The stages are:
+
+    - convert: python -> R conversion of the arguments
+    - call: running the R function (or looking it up in the result cache)
+    - wrap: preparing the result for ``.py``
+    - py: converting the result to python, the first time ``.py`` is accessed
+
+    Used as a context manager, it profiles just the calls made within the block::
+
+        with r.profile() as profiler:
+            model = r.lm(formula, data=df)
+        print(profiler.stats())
+    """
+
+    def __init__(self, exporter=None):
+        """
+        Args
+            exporter: optional function called with a dict describing each call (rname,
+                argBytes, and <stage>Wall/<stage>CPU times in seconds), eg to send it to a
+                metrics system
+        """
+        self.exporters = [exporter] if exporter is not None else []
+        self._totals = collections.OrderedDict()
+
+    def start(self):
+        if self not in _active:
+            _active.append(self)
+        return self
+
+    def stop(self):
+        if self in _active:
+            _active.remove(self)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def add(self, record, calls=1):
+        totals = self._totals.setdefault(record["rname"], collections.Counter())
+        totals["calls"] += calls
+        for key, value in record.items():
+            if key != "rname":
+                totals[key] += value
+
+        for exporter in self.exporters:
+            exporter(record)
+
+    def reset(self):
+        self._totals.clear()
+
+    def stats(self):
+        """ A DataFrame with one row per R function, sorted by total wall time """
+        columns = ["calls", "argBytes"] + [stage + kind for stage in STAGES for kind in ["Wall", "CPU"]]
+        stats = pandas.DataFrame([[totals.get(column, 0) for column in columns] for totals in self._totals.values()],
+                                 index=pandas.Index(list(self._totals.keys()), name="rname"), columns=columns)
+        stats["totalWall"] = stats[[stage + "Wall" for stage in STAGES]].sum(axis=1)
+        stats["totalCPU"] = stats[[stage + "CPU" for stage in STAGES]].sum(axis=1)
+        return stats.sort_values("totalWall", ascending=False)
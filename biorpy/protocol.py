@@ -0,0 +1,267 @@
+##
+## compact binary encoding of python values, numpy arrays and pandas objects, used to talk
+## to the R server (see biorpy.server)
+##
+import collections
+import struct
+
+import numpy
+import pandas
+
+# every message is preceded by its length
+HEADER = struct.Struct("<Q")
+
+_structs = {}
+
+def _struct(fmt):
+    if fmt not in _structs:
+        _structs[fmt] = struct.Struct(fmt)
+    return _structs[fmt]
+
+
+## ENCODING
+
+def _packString(value, out):
+    data = value.encode("utf-8")
+    out.append(_struct("<I").pack(len(data)))
+    out.append(data)
+
+def _packShape(shape, out):
+    out.append(_struct("<B").pack(len(shape)))
+    out.append(_struct("<{}q".format(len(shape))).pack(*shape))
+
+def _plainValues(values):
+    """ The values of a Series, Index or pandas array as a numpy array (or Categorical) """
+    dtype = values.dtype
+    if isinstance(dtype, pandas.CategoricalDtype):
+        return pandas.Categorical(values)
+    if getattr(dtype, "tz", None) is not None:
+        # sent as UTC times
+        return pandas.DatetimeIndex(values).tz_convert("UTC").tz_localize(None).values
+    if isinstance(dtype, pandas.api.extensions.ExtensionDtype):
+        if dtype.kind in "iuf":
+            return values.to_numpy(dtype=numpy.float64, na_value=numpy.nan)
+        return values.to_numpy(dtype=object, na_value=None)
+    return numpy.asarray(values)
+
+def _packArray(values, out):
+    if values.dtype.kind in "US":
+        values = values.astype(object)
+
+    if values.dtype.kind == "O":
+        out.append(b"o")
+        _packShape(values.shape, out)
+        for item in values.reshape(-1):
+            _pack(item, out)
+    else:
+        values = numpy.ascontiguousarray(values)
+        out.append(b"a")
+        _packString(values.dtype.str, out)
+        _packShape(values.shape, out)
+        # sent straight from the array's own memory
+        out.append(values.reshape(-1).view(numpy.uint8))
+
+def _packIndex(index, out):
+    if isinstance(index, pandas.MultiIndex):
+        out.append(b"X")
+        _pack([_plainValues(index.get_level_values(i)) for i in range(index.nlevels)], out)
+        _pack(list(index.names), out)
+    elif isinstance(index, pandas.RangeIndex):
+        out.append(b"R")
+        out.append(_struct("<qqq").pack(index.start, index.stop, index.step))
+        _pack(index.name, out)
+    else:
+        out.append(b"I")
+        _pack(_plainValues(index), out)
+        _pack(index.name, out)
+
+def _pack(value, out):
+    if value is None or value is pandas.NA or value is pandas.NaT:
+        out.append(b"N")
+    elif isinstance(value, (bool, numpy.bool_)):
+        out.append(b"T" if value else b"F")
+    elif isinstance(value, (int, numpy.integer)):
+        out.append(b"i" + _struct("<q").pack(int(value)))
+    elif isinstance(value, (float, numpy.floating)):
+        out.append(b"d" + _struct("<d").pack(float(value)))
+    elif isinstance(value, str):
+        out.append(b"s")
+        _packString(value, out)
+    elif isinstance(value, bytes):
+        out.append(b"b" + _struct("<Q").pack(len(value)))
+        out.append(value)
+    elif isinstance(value, (list, tuple)):
+        out.append(b"l" + _struct("<Q").pack(len(value)))
+        for item in value:
+            _pack(item, out)
+    elif isinstance(value, dict):
+        out.append(b"m" + _struct("<Q").pack(len(value)))
+        for key, item in value.items():
+            _pack(key, out)
+            _pack(item, out)
+    elif isinstance(value, numpy.ndarray):
+        _packArray(value, out)
+    elif isinstance(value, pandas.Categorical):
+        out.append(b"c")
+        _packArray(numpy.asarray(value.codes), out)
+        _pack(_plainValues(value.categories), out)
+        _pack(bool(value.ordered), out)
+    elif isinstance(value, pandas.api.extensions.ExtensionArray):
+        # eg the IntegerArray, BooleanArray or DatetimeArray for R vectors with NAs or a timezone
+        _pack(_plainValues(value), out)
+    elif isinstance(value, pandas.Series):
+        out.append(b"S")
+        _pack(_plainValues(value), out)
+        _pack(value.name, out)
+        _packIndex(value.index, out)
+    elif isinstance(value, pandas.DataFrame):
+        out.append(b"D")
+        _pack(list(value.columns), out)
+        _pack([_plainValues(value.iloc[:, i]) for i in range(value.shape[1])], out)
+        _packIndex(value.index, out)
+    elif isinstance(value, pandas.Index):
+        _packIndex(value, out)
+    elif hasattr(value, "_remoteID"):
+        # a handle to an object held by the server
+        out.append(b"r" + _struct("<q").pack(value._remoteID))
+        _pack(list(value.rclass), out)
+    elif isinstance(value, numpy.generic):
+        _pack(value.item(), out)
+    else:
+        raise Exception("Can't send objects of type {} to the R server".format(type(value).__name__))
+
+def encode(value):
+    """ Encodes value as a list of bytes-like chunks (large arrays aren't copied) """
+    out = []
+    _pack(value, out)
+    return out
+
+
+## DECODING
+
+class _Reader(object):
+    def __init__(self, data, makeRef):
+        self.data = memoryview(data)
+        self.position = 0
+        self.makeRef = makeRef
+
+    def take(self, n):
+        chunk = self.data[self.position:self.position+n]
+        self.position += n
+        return chunk
+
+    def unpack(self, fmt):
+        s = _struct(fmt)
+        values = s.unpack_from(self.data, self.position)
+        self.position += s.size
+        return values
+
+    def string(self):
+        n, = self.unpack("<I")
+        return str(self.take(n), "utf-8")
+
+    def shape(self):
+        ndim, = self.unpack("<B")
+        return self.unpack("<{}q".format(ndim))
+
+    def index(self):
+        tag = bytes(self.take(1))
+        if tag == b"R":
+            start, stop, step = self.unpack("<qqq")
+            return pandas.RangeIndex(start, stop, step, name=self.value())
+        if tag == b"X":
+            levels = self.value()
+            return pandas.MultiIndex.from_arrays(levels, names=self.value())
+        values = self.value()
+        return pandas.Index(values, name=self.value())
+
+    def value(self):
+        tag = bytes(self.take(1))
+        if tag == b"N":
+            return None
+        if tag in (b"T", b"F"):
+            return tag == b"T"
+        if tag == b"i":
+            return self.unpack("<q")[0]
+        if tag == b"d":
+            return self.unpack("<d")[0]
+        if tag == b"s":
+            return self.string()
+        if tag == b"b":
+            n, = self.unpack("<Q")
+            return bytes(self.take(n))
+        if tag == b"l":
+            n, = self.unpack("<Q")
+            return [self.value() for i in range(n)]
+        if tag == b"m":
+            n, = self.unpack("<Q")
+            return collections.OrderedDict((self.value(), self.value()) for i in range(n))
+        if tag == b"a":
+            dtype = numpy.dtype(self.string())
+            shape = self.shape()
+            count = int(numpy.prod(shape))
+            values = numpy.frombuffer(self.take(count * dtype.itemsize), dtype=dtype, count=count)
+            return values.reshape(shape)
+        if tag == b"o":
+            shape = self.shape()
+            values = numpy.empty(int(numpy.prod(shape)), dtype=object)
+            for i in range(len(values)):
+                values[i] = self.value()
+            return values.reshape(shape)
+        if tag == b"c":
+            codes = self.value()
+            categories = self.value()
+            return pandas.Categorical.from_codes(codes, categories=categories, ordered=self.value())
+        if tag == b"S":
+            values = self.value()
+            name = self.value()
+            return pandas.Series(values, index=self.index(), name=name)
+        if tag == b"D":
+            names = self.value()
+            columns = self.value()
+            df = pandas.DataFrame(collections.OrderedDict(enumerate(columns)), index=self.index())
+            df.columns = names
+            return df
+        if tag in (b"R", b"X", b"I"):
+            self.position -= 1
+            return self.index()
+        if tag == b"r":
+            remoteID, = self.unpack("<q")
+            return self.makeRef(remoteID, self.value())
+        raise Exception("Invalid message from the R server (unknown tag {!r})".format(tag))
+
+def decode(data, makeRef):
+    """ Decodes a message; makeRef(id, rclass) is called to create handles to R objects """
+    return _Reader(data, makeRef).value()
+
+
+## SOCKETS
+
+def send(sock, value):
+    sendChunks(sock, encode(value))
+
+def sendChunks(sock, chunks):
+    """ Sends a message already encoded with :func:`encode` """
+    sock.sendall(HEADER.pack(sum(memoryview(chunk).nbytes for chunk in chunks)))
+    for chunk in chunks:
+        sock.sendall(chunk)
+
+def _receiveInto(sock, buf):
+    view = memoryview(buf)
+    while len(view):
+        n = sock.recv_into(view)
+        if n == 0:
+            return False
+        view = view[n:]
+    return True
+
+def receive(sock, makeRef):
+    """ Reads and decodes one message, or returns None if the connection was closed """
+    header = bytearray(HEADER.size)
+    if not _receiveInto(sock, header):
+        return None
+    data = bytearray(HEADER.unpack(header)[0])
+    if not _receiveInto(sock, data):
+        return None
+    # arrays are decoded as (writable) views onto the received data, without copying
+    return decode(data, makeRef)
@@ -0,0 +1,49 @@
+import weakref
+
+_live = weakref.WeakSet()
+
+def liveRefs():
+    """ The :class:`RRef` handles that are still holding on to their R objects """
+    return [ref for ref in _live if not ref.released]
+
+
+class RRef(object):
+    """ A handle to an R object that has been converted (or created) once and is then passed
+    to handler calls as is, eg::
+
+        data = r.put(df)
+        fit = r.lm("y ~ x", data=data)
+        r.plot(data.robject.rx2("x"), r.predict(fit, data))
+
+    The R object is kept alive for as long as there are python references to the handle
+    (or until :meth:`release` is called), after which R's garbage collector can free it.
+    Handles are also context managers, releasing the R object at the end of the block. """
+
+    def __init__(self, robject, name=None):
+        self._robject = robject
+        self.name = name
+        _live.add(self)
+
+    @property
+    def released(self):
+        return self._robject is None
+
+    @property
+    def robject(self):
+        if self._robject is None:
+            raise Exception("This R object ({}) has been released".format(self.name or "unnamed"))
+        return self._robject
+
+    def release(self):
+        """ Drops the reference to the R object, so that R can garbage collect it """
+        self._robject = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def __repr__(self):
+        state = "released" if self.released else "live"
+        return "<RRef {} ({})>".format(self.name or "", state)
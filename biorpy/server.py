@@ -0,0 +1,332 @@
+##
+## a long-lived R process shared by several python clients
+##
+##   python -m biorpy.server --preload lattice mgcv &
+##
+##   from biorpy import server
+##   r = server.connect()
+##   fit = r.lm("y ~ x", data=df)
+##   print(r.summary(fit).py["r.squared"])
+##
+import argparse
+import collections
+import getpass
+import itertools
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+import weakref
+
+import numpy
+from biorpy.lazymodule import LazyModule
+robjects = LazyModule("rpy2.robjects")
+rinterface = LazyModule("rpy2.rinterface")
+
+from biorpy import conversion, helpers, protocol
+
+DEFAULT_PATH = os.path.join(tempfile.gettempdir(), "biorpy-{}.sock".format(getpass.getuser()))
+
+
+## SERVER
+
+class _ServerRef(object):
+    """ An R object held by the server for a client, as sent over the socket """
+
+    def __init__(self, remoteID, rclass):
+        self._remoteID = remoteID
+        self.rclass = rclass
+
+
+class _Client(object):
+    """ Server-side state of a connection: its own R environment (for ``r("...")``, so that
+    clients don't see each other's variables) and the R objects it holds handles to """
+
+    def __init__(self):
+        self.env = robjects.baseenv["new.env"](parent=robjects.globalenv)
+        self.objects = {}
+        self._ids = itertools.count(1)
+
+    def store(self, robj):
+        remoteID = next(self._ids)
+        self.objects[remoteID] = robj
+        return _ServerRef(remoteID, list(robjects.baseenv["class"](robj)))
+
+    def resolve(self, value):
+        if isinstance(value, _ServerRef):
+            try:
+                return self.objects[value._remoteID]
+            except KeyError:
+                raise Exception("Unknown (already released?) R object handle {}".format(value._remoteID))
+        return value
+
+    def toPython(self, robj):
+        """ Converts an R object for sending; anything without a python equivalent (functions,
+        environments, S4 objects...) is kept on the server and sent as a handle """
+        if conversion.isNULL(robj):
+            return None
+        if isinstance(robj, robjects.vectors.DataFrame):
+            return conversion.rpy2DataFrameToPandasDataFrame(robj)
+        if isinstance(robj, robjects.vectors.ListVector):
+            items = [self.toPython(item) for item in robj]
+            names = robj.names
+            if isinstance(names, robjects.vectors.StrVector):
+                return collections.OrderedDict(zip(names, items))
+            return items
+        if isinstance(robj, robjects.vectors.Vector):
+            values = conversion.rVectorToArray(robj)
+            if values is None:
+                values = numpy.array(robj)
+            try:
+                dim = tuple(robj.do_slot("dim"))
+            except LookupError:
+                dim = None
+            if dim is not None and isinstance(values, numpy.ndarray):
+                values = values.reshape(dim, order="F")
+            return values
+        return self.store(robj)
+
+
+class _ConnectionHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        rserver = self.server.rserver
+        client = rserver.run(_Client)
+        try:
+            while True:
+                message = protocol.receive(self.request, _ServerRef)
+                if message is None:
+                    break
+                reply = rserver.run(rserver.process, client, message)
+                try:
+                    chunks = protocol.encode(reply)
+                except Exception as e:
+                    chunks = protocol.encode(["error", "Can't send the result: {}".format(e)])
+                protocol.sendChunks(self.request, chunks)
+        finally:
+            # drops the client's R objects, and its environment
+            rserver.run(client.objects.clear)
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class RServer(object):
+    """ Serves the embedded R session to clients connecting over a Unix socket. Packages are
+    loaded once and shared by all clients, while each client gets its own environment for
+    evaluating code. R calls from all clients are run one at a time on the R thread (see
+    :class:`biorpy.executor.RExecutor`). """
+
+    def __init__(self, path=DEFAULT_PATH, preload=()):
+        """
+        Args
+            path: the socket file to listen on (only accessible to the current user)
+            preload: names of R packages to load at startup
+        """
+        from biorpy import betteR
+        self.path = path
+        self.betteR = betteR.BetteR(wrapResults=False)
+        self.executor = self.betteR.executor()
+
+        self.run(self._start, preload)
+
+        if os.path.exists(path):
+            if _listening(path):
+                raise Exception("An R server is already listening on {}".format(path))
+            os.remove(path)
+
+        oldmask = os.umask(0o077)
+        try:
+            self._server = _UnixServer(path, _ConnectionHandler)
+        finally:
+            os.umask(oldmask)
+        self._server.rserver = self
+
+    def _start(self, preload):
+        # R is started here, on the R thread
+        helpers.requirePackages(*preload)
+        self._eval = robjects.r("function(code, env) eval(parse(text=code), envir=env)")
+        self._exists = robjects.baseenv["exists"]
+
+    def run(self, fn, *args, **kwdargs):
+        """ Runs fn on the R thread and returns its result """
+        return self.executor.submit(fn, *args, **kwdargs).result()
+
+    def _call(self, client, rname, args, kwdargs):
+        args = [client.resolve(arg) for arg in args]
+        kwdargs = dict((key, client.resolve(value)) for key, value in kwdargs.items())
+
+        if self._exists(rname, envir=client.env, inherits=False)[0]:
+            # a function the client defined itself
+            args = [conversion.convertToR(arg) for arg in args]
+            kwdargs = dict((key, conversion.convertToR(value)) for key, value in kwdargs.items())
+            return client.env[rname](*args, **kwdargs)
+        return self.betteR[rname](*args, **kwdargs)
+
+    def process(self, client, message):
+        """ Handles one request (on the R thread); returns the reply """
+        op, released = message[0], message[1]
+        for remoteID in released:
+            client.objects.pop(remoteID, None)
+
+        try:
+            if op == "call":
+                rname, args, kwdargs = message[2:]
+                return ["ok", client.store(self._call(client, rname, args, kwdargs))]
+            elif op == "eval":
+                return ["ok", client.store(self._eval(message[2], client.env))]
+            elif op == "get":
+                return ["ok", client.toPython(client.resolve(message[2]))]
+            elif op == "free":
+                return ["ok", None]
+            return ["error", "Unknown request '{}'".format(op)]
+        except Exception as e:
+            return ["error", str(e)]
+
+    def serve(self):
+        """ Handles clients until interrupted """
+        try:
+            self._server.serve_forever()
+        finally:
+            self.close()
+
+    def close(self):
+        self._server.server_close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.executor.shutdown(wait=False)
+
+
+def _listening(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+## CLIENT
+
+class RemoteObject(object):
+    """ A handle to an R object that stays in the server's memory. It can be passed as an
+    argument to later calls without being transferred again; ``.py`` downloads it (converted
+    to python, as for the ``.py`` attribute of local results). The server drops the
+    object once the handle is garbage collected. """
+
+    def __init__(self, client, remoteID, rclass):
+        self._remoteID = remoteID
+        self.rclass = rclass
+        self._client = client
+        self._py = None
+        self._converted = False
+        weakref.finalize(self, client._release, remoteID)
+
+    @property
+    def py(self):
+        if not self._converted:
+            self._py = self._client.get(self)
+            self._converted = True
+        return self._py
+
+    def __repr__(self):
+        return "<RemoteObject {} of class {}>".format(self._remoteID, "/".join(self.rclass))
+
+
+class RemoteHandler(object):
+    def __init__(self, client, rname):
+        self.client = client
+        self.rname = rname
+
+    def __call__(self, *args, **kwdargs):
+        return self.client._request("call", self.rname, list(args), kwdargs)
+
+
+class RemoteR(object):
+    """ Client for an :class:`RServer`, used like ``biorpy.r``: ``r.lm(...)``,
+    ``r["wilcox.test"](...)`` or ``r("code")``. Arguments are converted by the server (so
+    handlers' default arguments still apply), and every result is returned as a
+    :class:`RemoteObject`. """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(path)
+        self._lock = threading.Lock()
+        self._released = []
+
+    def _makeRef(self, remoteID, rclass):
+        return RemoteObject(self, remoteID, rclass)
+
+    def _release(self, remoteID):
+        # sent along with the next request, since this may run in the middle of another one
+        self._released.append(remoteID)
+
+    def _request(self, op, *args):
+        with self._lock:
+            if self._socket is None:
+                raise Exception("The connection to the R server has been closed")
+            released, self._released = self._released, []
+            protocol.send(self._socket, [op, released] + list(args))
+            reply = protocol.receive(self._socket, self._makeRef)
+
+        if reply is None:
+            raise Exception("The R server at {} closed the connection".format(self.path))
+        if reply[0] == "error":
+            raise Exception("Error in R server: {}".format(reply[1]))
+        return reply[1]
+
+    def __getattr__(self, attr):
+        if attr.startswith("__"):
+            raise AttributeError(attr)
+        return RemoteHandler(self, attr)
+
+    def __getitem__(self, attr):
+        return RemoteHandler(self, attr)
+
+    def __call__(self, string):
+        """ Evaluates R code in this client's environment on the server """
+        return self._request("eval", string)
+
+    def get(self, handle):
+        """ Downloads the R object behind a :class:`RemoteObject`, converted to python """
+        return self._request("get", handle)
+
+    def close(self):
+        with self._lock:
+            if self._socket is not None:
+                self._socket.close()
+                self._socket = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def connect(path=DEFAULT_PATH, fallback=True):
+    """ Connects to the R server listening on path. If there's none and fallback is True,
+    returns the embedded ``biorpy.r`` instead (which starts R in this process). """
+    try:
+        return RemoteR(path)
+    except OSError:
+        if not fallback:
+            raise
+        from biorpy import r
+        return r
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs an R server for biorpy clients")
+    parser.add_argument("--path", default=DEFAULT_PATH, help="socket file to listen on")
+    parser.add_argument("--preload", nargs="*", default=[], help="R packages to load at startup")
+    args = parser.parse_args()
+
+    RServer(args.path, args.preload).serve()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+import numpy
+import pandas
+from biorpy.lazymodule import LazyModule
+robjects = LazyModule("rpy2.robjects")
+
+from biorpy import conversion, executor
+from biorpy.conversion import automaticRowNames, INT32_RANGE, _bufferView, _makeDataFrame, _typedBuffer
+
+# R vector modes for each numpy dtype kind, and the dtype of their memory
+STREAM_MODES = {"f": ("double", numpy.float64),
+                "i": ("integer", numpy.int32),
+                "u": ("integer", numpy.int32),
+                "b": ("logical", numpy.int32)}
+
+
+def _chunks(source, chunksize):
+    """ Turns the supported inputs into an iterator of DataFrames """
+    if isinstance(source, pandas.DataFrame):
+        for start in range(0, len(source), chunksize):
+            yield source.iloc[start:start+chunksize]
+    elif hasattr(source, "iter_batches"):
+        # eg pyarrow.parquet.ParquetFile
+        for batch in source.iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        for chunk in source:
+            yield chunk
+
+def _countRows(source):
+    if isinstance(source, pandas.DataFrame):
+        return len(source)
+    if hasattr(source, "iter_batches") and hasattr(source, "metadata"):
+        return source.metadata.num_rows
+    return None
+
+
+class _ColumnBuffer(object):
+    """ Accumulates one column of the R data.frame. Numeric and logical columns are
+    preallocated in R and filled in place; other columns are converted chunk by chunk
+    and joined in R at the end. """
+
+    def __init__(self, dtype, capacity, exactTypes):
+        kind = dtype.kind
+        if kind in "iu" and not exactTypes:
+            # a later chunk may contain missing values and come in as floats
+            kind = "f"
+        self.mode = STREAM_MODES.get(kind)
+        self.pieces = []
+        self.vector = None
+        self.capacity = 0
+
+        if self.mode is not None:
+            self._resize(capacity)
+
+    def _resize(self, capacity):
+        if self.vector is None:
+            self.vector = robjects.baseenv["vector"](self.mode[0], capacity)
+        else:
+            self.vector = robjects.baseenv["length<-"](self.vector, capacity)
+        self.view = _bufferView(self.vector, self.mode[1])
+        self.capacity = capacity
+
+    def _toPieces(self, start):
+        """ Switches to converting chunk by chunk, keeping the rows written so far; eg for a
+        column that was all NaN (so float) in the first chunk, but holds strings later on """
+        if start > 0:
+            self.pieces.append(robjects.baseenv["length<-"](self.vector, start))
+        self.mode = None
+        self.vector = None
+        self.view = None
+        self.capacity = 0
+
+    def _toDouble(self):
+        """ Switches an integer column to double, for values that don't fit in an R integer """
+        self.vector = robjects.baseenv["as.double"](self.vector)
+        self.mode = STREAM_MODES["f"]
+        self.view = _bufferView(self.vector, self.mode[1])
+
+    def write(self, start, series):
+        if self.mode is not None and series.dtype.kind not in STREAM_MODES:
+            self._toPieces(start)
+
+        if self.mode is None:
+            self.pieces.append(conversion.seriesToRVector(series))
+            return
+
+        values, mask = conversion._seriesValues(series)
+        if self.mode[0] == "integer" and len(values) > 0 and \
+                (values.min() < INT32_RANGE[0] or values.max() > INT32_RANGE[1]):
+            self._toDouble()
+
+        stop = start + len(series)
+        if stop > self.capacity:
+            self._resize(max(stop, self.capacity * 2))
+        self.view[start:stop] = _typedBuffer(values, self.mode[1], mask)
+
+    def finish(self, nrows):
+        if self.mode is None:
+            if len(self.pieces) == 1:
+                return self.pieces[0]
+            return robjects.baseenv["c"](*self.pieces)
+        if self.capacity != nrows:
+            self._resize(nrows)
+        return self.vector
+
+
+def streamToRDataFrame(source, chunksize=100000, nrows=None):
+    """
+    Convert a DataFrame, or a sequence of DataFrames, to an R data.frame in fixed-size row
+    chunks, so that the python-side overhead is bounded by the chunk size rather than the
+    size of the table.
+
+    Numeric and logical columns are allocated in R up front (when the number of rows is
+    known) and each chunk is copied straight into them; string columns are converted per
+    chunk. The index is not transferred -- the result has R's automatic row names.
+
+    Args:
+        source: a pandas DataFrame, an iterator of DataFrames (eg ``pandas.read_csv(..., chunksize=n)``
+            or ``HDFStore.select(..., chunksize=n)``), or a reader with an ``iter_batches()``
+            method such as ``pyarrow.parquet.ParquetFile``
+        chunksize: number of rows to convert at a time
+        nrows: the total number of rows, if known, for iterators; used to preallocate
+
+    Returns:
+        An R data.frame
+    """
+    rexecutor = executor.activeExecutor()
+    if rexecutor is not None and not rexecutor.onThread():
+        return rexecutor.submit(streamToRDataFrame, source, chunksize, nrows).result()
+
+    if nrows is None:
+        nrows = _countRows(source)
+    # column types are only certain if we can see the whole table up front
+    exactTypes = isinstance(source, pandas.DataFrame)
+
+    names = None
+    buffers = None
+    written = 0
+
+    for chunk in _chunks(source, chunksize):
+        if buffers is None:
+            names = [str(column) for column in chunk.columns]
+            capacity = nrows if nrows is not None else max(len(chunk), 1) * 2
+            buffers = [_ColumnBuffer(dtype, capacity, exactTypes) for dtype in chunk.dtypes]
+
+        for i, buf in enumerate(buffers):
+            buf.write(written, chunk.iloc[:, i])
+        written += len(chunk)
+
+    if buffers is None:
+        return robjects.DataFrame({})
+
+    columns = [buf.finish(written) for buf in buffers]
+    return _makeDataFrame(columns, names, automaticRowNames(written))
@@ -0,0 +1,22 @@
+import numpy
+import pandas
+
+from biorpy import battery
+
+
+def test_categorical_features_in_order_of_appearance():
+    column = pandas.Series(pandas.Categorical(["b", "a", "b", "a"], categories=["a", "b", "c"]))
+    index, features = battery._features(column)
+    assert list(index) == ["b", "a"]
+    assert list(features.categories) == ["b", "a"]
+    assert list(features.codes) == [0, 1, 0, 1]
+
+def test_features_skip_nan():
+    index, features = battery._features(pandas.Series(["x", numpy.nan, "y", "x"]))
+    assert list(index) == ["x", "y"]
+    assert list(features.codes) == [0, -1, 1, 0]
+
+    # a group missing some features still gets them all, in the same order
+    index, features = battery._features(pandas.Series(["y"]), index)
+    assert list(features.categories) == ["x", "y"]
+    assert list(features.codes) == [1]
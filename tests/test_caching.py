@@ -0,0 +1,28 @@
+import numpy
+import pandas
+
+from biorpy import caching
+
+
+def test_fingerprint_is_stable():
+    df = pandas.DataFrame({"a": [1, 2, 3], "b": ["x", "y", "z"]})
+    assert caching.fingerprint(df) == caching.fingerprint(df.copy())
+
+def test_fingerprint_changes_with_content():
+    df = pandas.DataFrame({"a": [1, 2, 3]})
+    before = caching.fingerprint(df)
+    df.loc[1, "a"] = 5
+    assert caching.fingerprint(df) != before
+
+def test_fingerprint_includes_index_and_metadata():
+    df = pandas.DataFrame({"a": [1, 2, 3]})
+    assert caching.fingerprint(df) != caching.fingerprint(df.set_axis([3, 4, 5]))
+    assert caching.fingerprint(df) != caching.fingerprint(df.rename(columns={"a": "b"}))
+    assert caching.fingerprint(df) != caching.fingerprint(df.astype(float))
+
+def test_fingerprint_arrays():
+    values = numpy.arange(10.0)
+    assert caching.fingerprint(values) == caching.fingerprint(values.copy())
+    assert caching.fingerprint(values) != caching.fingerprint(values.reshape(2, 5))
+    assert caching.fingerprint(numpy.array(["a"], dtype=object)) is None
+    assert caching.fingerprint([1, 2]) is None
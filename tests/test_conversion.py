@@ -0,0 +1,26 @@
+import numpy
+
+from biorpy import conversion
+
+
+def kind(values):
+    types = set(map(type, values))
+    types.discard(type(None))
+    return conversion._sequenceKind(types)
+
+def test_sequence_kinds():
+    assert kind([]) == "logical"
+    assert kind([None]) == "logical"
+    assert kind([True, False, numpy.bool_(True)]) == "logical"
+    assert kind([1, 2, None]) == "integer"
+    assert kind([True, 2, numpy.int64(3)]) == "integer"
+    assert kind([1, 2.5]) == "double"
+    assert kind([numpy.float32(1), 2]) == "double"
+    assert kind(["a", 1]) == "character"
+    assert kind(["a", None]) == "character"
+
+def test_nested_sequences_are_lists():
+    assert kind([[1, 2], 3]) == "list"
+    assert kind([(1,), None]) == "list"
+    assert kind([{"a": 1}]) == "list"
+    assert kind([numpy.arange(3), numpy.arange(2)]) == "list"
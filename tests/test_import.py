@@ -0,0 +1,29 @@
+import os
+import subprocess
+import sys
+
+# seconds that "import biorpy" may take (see doc/source/installation.rst)
+IMPORT_BUDGET = 0.1
+
+SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import biorpy
+print(time.perf_counter() - start)
+print(" ".join(sorted(name for name in sys.modules if name.split(".")[0] in ("rpy2", "pandas", "numpy"))))
+"""
+
+def _importBiorpy():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output([sys.executable, "-c", SCRIPT], cwd=root, universal_newlines=True).split("\n")
+    return float(output[0]), output[1].split()
+
+def test_import_loads_no_rpy2_or_pandas():
+    seconds, loaded = _importBiorpy()
+    assert not [name for name in loaded if name.startswith("rpy2")]
+    assert "pandas" not in loaded and "numpy" not in loaded
+
+def test_import_time():
+    # the best of a few runs, to allow for a cold disk cache
+    seconds = min(_importBiorpy()[0] for i in range(3))
+    assert seconds < IMPORT_BUDGET
@@ -0,0 +1,19 @@
+import numpy
+import pandas
+
+from biorpy import pool
+
+
+def test_only_plain_numeric_arrays_are_shared():
+    values = pandas.Series(numpy.arange(100, dtype=numpy.float64))
+    shared = pool._share(values, 0)
+    try:
+        assert isinstance(shared, pool._SharedArray)
+        assert shared.asSeries
+    finally:
+        shared.release()
+
+    for arg in [pandas.Series([True, None] * 50, dtype="boolean"),
+                pandas.Series([1, None] * 50, dtype="Int64"),
+                numpy.array(["a"] * 100, dtype=object)]:
+        assert pool._share(arg, 0) is arg
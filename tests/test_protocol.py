@@ -0,0 +1,131 @@
+import collections
+
+import numpy
+import pandas
+
+from biorpy import protocol
+
+
+class Ref(object):
+    def __init__(self, remoteID, rclass):
+        self._remoteID = remoteID
+        self.rclass = rclass
+
+def roundTrip(value):
+    data = b"".join(bytes(memoryview(chunk).cast("B")) for chunk in protocol.encode(value))
+    return protocol.decode(bytearray(data), Ref)
+
+
+def test_scalars():
+    for value in [None, True, False, 0, -3, 2**40, 1.5, "", "héllo", b"\x00\x01"]:
+        result = roundTrip(value)
+        assert result == value and type(result) == type(value)
+
+def test_containers():
+    value = [1, "a", [None, 2.5], {"x": [1, 2], 3: "y"}]
+    result = roundTrip(value)
+    assert result == value
+    assert isinstance(result[3], collections.OrderedDict)
+    assert roundTrip((1, 2)) == [1, 2]
+
+def test_numpy_scalars():
+    assert roundTrip(numpy.float64(2.5)) == 2.5
+    assert roundTrip(numpy.int32(7)) == 7
+    assert roundTrip(numpy.bool_(True)) is True
+
+def test_numeric_arrays():
+    for values in [numpy.arange(10, dtype=numpy.int32),
+                   numpy.array([1.5, numpy.nan, -2.0]),
+                   numpy.array([True, False]),
+                   numpy.arange(12, dtype=numpy.uint16).reshape(3, 4),
+                   numpy.arange(6.0).reshape(2, 3)[:, ::2],
+                   numpy.array(["2020-01-01", "NaT"], dtype="datetime64[ns]"),
+                   numpy.array([], dtype=numpy.float64)]:
+        result = roundTrip(values)
+        assert result.dtype == values.dtype
+        assert result.shape == values.shape
+        numpy.testing.assert_array_equal(result, values)
+
+def test_decoded_arrays_are_writable():
+    result = roundTrip(numpy.arange(5.0))
+    result[0] = 10
+    assert result[0] == 10
+
+def test_string_arrays():
+    values = numpy.array(["a", None, "c"], dtype=object)
+    result = roundTrip(values)
+    assert list(result) == ["a", None, "c"]
+    assert list(roundTrip(numpy.array(["x", "yz"]))) == ["x", "yz"]
+
+def test_categorical():
+    values = pandas.Categorical(["b", "a", None, "b"], categories=["b", "a"], ordered=True)
+    result = roundTrip(values)
+    assert list(result.categories) == ["b", "a"]
+    assert result.ordered
+    numpy.testing.assert_array_equal(result.codes, values.codes)
+
+def test_extension_arrays():
+    result = roundTrip(pandas.array([1, None, 3], dtype="Int64"))
+    numpy.testing.assert_array_equal(result, [1.0, numpy.nan, 3.0])
+
+    result = roundTrip(pandas.array([True, None], dtype="boolean"))
+    assert list(result) == [True, None]
+
+    times = pandas.DatetimeIndex(["2020-01-01 12:00"]).tz_localize("US/Eastern").array
+    result = roundTrip(times)
+    assert pandas.Timestamp(result[0]) == pandas.Timestamp("2020-01-01 17:00")
+
+def test_series():
+    series = pandas.Series([1.0, 2.0, numpy.nan], index=["a", "b", "c"], name="x")
+    pandas.testing.assert_series_equal(roundTrip(series), series)
+
+def test_dataframe():
+    df = pandas.DataFrame(collections.OrderedDict([
+        ("x", [1, 2, 3]),
+        ("y", [0.5, numpy.nan, 1.5]),
+        ("s", ["a", "b", None]),
+        ("c", pandas.Categorical(["u", "v", "u"])),
+        ("t", pandas.to_datetime(["2020-01-01", "2020-01-02", None]))]))
+    result = roundTrip(df)
+    assert list(result.columns) == list(df.columns)
+    pandas.testing.assert_frame_equal(result, df, check_index_type=False)
+
+def test_indexes():
+    df = pandas.DataFrame({"v": [1.0, 2.0]}, index=pandas.RangeIndex(10, 14, 2, name="i"))
+    result = roundTrip(df)
+    assert isinstance(result.index, pandas.RangeIndex)
+    assert list(result.index) == [10, 12] and result.index.name == "i"
+
+    index = pandas.MultiIndex.from_arrays([["a", "b"], [1, 2]], names=["k1", "k2"])
+    result = roundTrip(pandas.Series([1.0, 2.0], index=index))
+    assert list(result.index) == [("a", 1), ("b", 2)]
+    assert list(result.index.names) == ["k1", "k2"]
+
+def test_remote_references():
+    result = roundTrip(["call", Ref(12, ["lm"])])
+    assert isinstance(result[1], Ref)
+    assert result[1]._remoteID == 12 and result[1].rclass == ["lm"]
+
+def test_unsupported_type():
+    try:
+        protocol.encode(object())
+    except Exception as e:
+        assert "Can't send" in str(e)
+    else:
+        assert False, "should have raised"
+
+def test_socket_round_trip():
+    import socket
+    import threading
+
+    left, right = socket.socketpair()
+    df = pandas.DataFrame({"x": numpy.arange(100000.0)})
+    sender = threading.Thread(target=protocol.send, args=(left, ["ok", df]))
+    sender.start()
+    result = protocol.receive(right, Ref)
+    sender.join()
+    pandas.testing.assert_frame_equal(result[1], df)
+
+    left.close()
+    assert protocol.receive(right, Ref) is None
+    right.close()
@@ -0,0 +1,60 @@
+import io
+
+import numpy
+import pandas
+
+from biorpy import conversion, streaming
+
+
+def test_dataframe_chunks():
+    df = pandas.DataFrame({"a": range(10)})
+    chunks = list(streaming._chunks(df, 4))
+    assert [len(chunk) for chunk in chunks] == [4, 4, 2]
+    pandas.testing.assert_frame_equal(pandas.concat(chunks), df)
+    assert streaming._countRows(df) == 10
+
+def test_iterator_chunks():
+    reader = pandas.read_csv(io.StringIO("a,b\n1,x\n2,y\n3,z\n"), chunksize=2)
+    chunks = list(streaming._chunks(reader, 1000))
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    assert streaming._countRows(iter([])) is None
+
+class FakeBatch(object):
+    def __init__(self, df):
+        self.df = df
+
+    def to_pandas(self):
+        return self.df
+
+class FakeParquetFile(object):
+    """ Mimics the parts of pyarrow.parquet.ParquetFile used by streaming """
+    class metadata(object):
+        num_rows = 5
+
+    def iter_batches(self, batch_size):
+        for start in range(0, 5, batch_size):
+            yield FakeBatch(pandas.DataFrame({"a": range(start, min(start + batch_size, 5))}))
+
+def test_batch_reader_chunks():
+    source = FakeParquetFile()
+    chunks = list(streaming._chunks(source, 2))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert streaming._countRows(source) == 5
+
+def buffer(mode):
+    """ A column buffer writing into a numpy array instead of an R vector """
+    buf = streaming._ColumnBuffer.__new__(streaming._ColumnBuffer)
+    buf.mode = streaming.STREAM_MODES[mode]
+    buf.view = numpy.zeros(4, dtype=buf.mode[1])
+    buf.capacity = 4
+    return buf
+
+def test_nullable_columns():
+    buf = buffer("b")
+    buf.write(0, pandas.Series([True, None], dtype="boolean"))
+    buf.write(2, pandas.Series([None, False], dtype="boolean"))
+    assert list(buf.view) == [1, conversion.NA_INTEGER, conversion.NA_INTEGER, 0]
+
+    buf = buffer("i")
+    buf.write(0, pandas.Series([1, None, 3, None], dtype="Int64"))
+    assert list(buf.view) == [1, conversion.NA_INTEGER, 3, conversion.NA_INTEGER]